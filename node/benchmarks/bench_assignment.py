@@ -0,0 +1,49 @@
+"""
+Time and quality of the drone-to-target assignment solvers at 100, 1k, 2k and 5k drones.
+
+Drones start spread in a cube, the targets lie on a ring like the outline of a formation. The total and the longest
+flight distance are printed next to the solver time, the Hungarian solver is skipped where it takes minutes. Run from
+the node directory:
+
+    python benchmarks/bench_assignment.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from assignment import assign_targets, distance_matrix
+
+HUNGARIAN_LIMIT = 2000
+BOTTLENECK_LIMIT = 1000
+
+
+def ring_targets(n, radius):
+    angle = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return np.column_stack((radius * np.cos(angle), radius * np.sin(angle), np.full(n, 2.0)))
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    print(f"{'drones':>7} | {'method':>9} | {'objective':>9} | {'time [ms]':>10} | {'total [m]':>10} | {'max [m]':>8}")
+    for n in (100, 1000, 2000, 5000):
+        positions = rng.uniform(-10, 10, (n, 3))
+        targets = ring_targets(n, radius=20)
+        cost = distance_matrix(positions, targets)
+        runs = [('hungarian', 'total'), ('auction', 'total'), ('greedy', 'total'), ('auction', 'max')]
+        for method, objective in runs:
+            if method == 'hungarian' and n > HUNGARIAN_LIMIT or objective == 'max' and n > BOTTLENECK_LIMIT:
+                print(f"{n:>7} | {method:>9} | {objective:>9} | {'-':>10} | {'-':>10} | {'-':>8}")
+                continue
+            start = time.perf_counter()
+            assignment = assign_targets(positions, targets, method, objective)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            flights = cost[np.arange(n), assignment]
+            print(f"{n:>7} | {method:>9} | {objective:>9} | {elapsed_ms:>10.1f} | {flights.sum():>10.1f} | "
+                  f"{flights.max():>8.2f}")
+        # The old behaviour: drones paired with targets in arbitrary order
+        flights = cost[np.arange(n), np.arange(n)]
+        print(f"{n:>7} | {'in order':>9} | {'-':>9} | {'-':>10} | {flights.sum():>10.1f} | {flights.max():>8.2f}")
@@ -0,0 +1,155 @@
+"""
+Engine benchmark suite: physics ticks/sec, control latency, jitter against the target fps and memory per drone.
+
+Each swarm size is measured twice, once with one World/FlightController pair per drone and once with a SwarmWorld and
+a SwarmFlightController. Results are printed and written as JSON so runs can be compared over time, by default to
+benchmarks/results/ which is not tracked by git. Run from the node directory:
+
+    python benchmarks/bench_engine.py --sizes 10 100 1000 10000 --output benchmarks/results/engine_benchmark.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'middleware'))
+
+from engine import World, FlightController, SwarmWorld, SwarmFlightController, C3d
+from Scheduler import TickScheduler
+
+FPS = 100
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'engine_benchmark.json')
+
+
+class PerDroneSetup:
+    variant = 'per_drone'
+
+    def __init__(self, n, rng):
+        start = rng.uniform(-10, 10, (n, 3))
+        self.worlds = [World(max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2, start_position=C3d(*p), fps=FPS,
+                             disable_lg=True) for p in start.tolist()]
+        self.controllers = [FlightController(world_ref=w, start_destination=C3d(0, 0, 0)) for w in self.worlds]
+
+    def physics_step(self):
+        dt = 1 / FPS
+        for world in self.worlds:
+            world.step(dt)
+
+    def control_step(self):
+        for fc in self.controllers:
+            fc.control_step()
+
+
+class SwarmSetup:
+    variant = 'swarm'
+
+    def __init__(self, n, rng):
+        self.swarm = SwarmWorld(n, max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2,
+                                start_positions=rng.uniform(-10, 10, (n, 3)), fps=FPS, disable_lg=True)
+        self.controller = SwarmFlightController(self.swarm, start_destinations=C3d(0, 0, 0))
+
+    def physics_step(self):
+        self.swarm.step(1 / FPS)
+
+    def control_step(self):
+        self.controller.control_step()
+
+
+def stats_ms(samples_s):
+    arr = np.asarray(samples_s) * 1000
+    return {'mean': float(arr.mean()), 'p50': float(np.percentile(arr, 50)), 'p99': float(np.percentile(arr, 99)),
+            'max': float(arr.max())}
+
+
+def measure_memory(setup_cls, n):
+    # Warm up so one-time allocations (caches, lazy imports) are not attributed to the drones
+    setup_cls(1, np.random.default_rng(0))
+    tracemalloc.start()
+    setup = setup_cls(n, np.random.default_rng(0))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return setup, current / n
+
+
+def measure_ticks_per_s(setup, min_duration_s):
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_duration_s or ticks < 3:
+        setup.physics_step()
+        ticks += 1
+    return ticks / (time.perf_counter() - start)
+
+
+def measure_control_latency(setup, min_duration_s):
+    samples = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_duration_s or len(samples) < 3:
+        t = time.perf_counter()
+        setup.control_step()
+        samples.append(time.perf_counter() - t)
+    return samples
+
+
+def measure_jitter(setup, duration_s):
+    # Paced run on the scheduler the nodes use, the physics task is timestamped on every execution
+    stamps = []
+
+    def physics_task():
+        stamps.append(time.perf_counter())
+        setup.physics_step()
+
+    scheduler = TickScheduler(name="bench")
+    task = scheduler.add_periodic("physics", 1 / FPS, physics_task)
+    scheduler.add_periodic("control", 0.1, setup.control_step)
+    scheduler.call_later(duration_s, scheduler.stop)
+    scheduler.run_forever()
+
+    intervals = np.diff(stamps)
+    deviation = np.abs(intervals - 1 / FPS)
+    return {'achieved_fps': float(len(intervals) / (stamps[-1] - stamps[0])) if len(stamps) > 1 else 0.0,
+            'jitter_ms': stats_ms(deviation) if len(deviation) else None,
+            'overruns': task.overruns, 'missed_periods': task.missed_periods}
+
+
+def run(sizes, duration_s):
+    results = []
+    for n in sizes:
+        for setup_cls in (PerDroneSetup, SwarmSetup):
+            setup, memory_per_drone = measure_memory(setup_cls, n)
+            result = {'variant': setup_cls.variant, 'drones': n, 'target_fps': FPS,
+                      'memory_per_drone_bytes': memory_per_drone,
+                      'physics_ticks_per_s': measure_ticks_per_s(setup, duration_s / 2),
+                      'control_latency_ms': stats_ms(measure_control_latency(setup, duration_s / 2))}
+            result.update(measure_jitter(setup, duration_s))
+            results.append(result)
+            print(f"{setup_cls.variant:>9} | {n:>6} | {result['physics_ticks_per_s']:>12.1f} | "
+                  f"{result['control_latency_ms']['mean']:>12.3f} | {result['achieved_fps']:>9.1f} | "
+                  f"{result['jitter_ms']['p99'] if result['jitter_ms'] else float('nan'):>14.3f} | "
+                  f"{memory_per_drone:>10.0f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Droneworks engine benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--duration', type=float, default=2.0, help="Seconds per measurement")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    print(f"{'variant':>9} | {'drones':>6} | {'ticks/s':>12} | {'control [ms]':>12} | {'fps':>9} | "
+          f"{'jitter p99[ms]':>14} | {'B/drone':>10}")
+    results = run(args.sizes, args.duration)
+    report = {'benchmark': 'engine', 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+              'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
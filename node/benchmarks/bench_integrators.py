@@ -0,0 +1,55 @@
+"""
+Accuracy versus cost of the World integrators.
+
+Every integrator flies the same open loop throttle schedule (a new throttle every 100 ms) at several fps. The position
+is compared against an RK4 reference run at 10 kHz at every throttle change. Run from the node directory:
+
+    python benchmarks/bench_integrators.py
+"""
+import math
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import World, C3d, INTEGRATORS
+
+DURATION_S = 10
+THROTTLE_INTERVAL_S = 0.1
+REFERENCE_FPS = 10000
+TEST_FPS = (10, 20, 50, 100, 200)
+
+
+def throttle_at(k):
+    t = k * THROTTLE_INTERVAL_S
+    return C3d(math.sin(t), math.cos(0.7 * t), 0.5 * math.sin(1.3 * t + 1))
+
+
+def fly(integrator, fps):
+    world = World(max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2, start_position=C3d(0, 0, 0), fps=fps,
+                  disable_lg=True, integrator=integrator)
+    steps_per_throttle = round(fps * THROTTLE_INTERVAL_S)
+    dt = 1 / fps
+    samples = []
+    start = time.perf_counter()
+    for k in range(round(DURATION_S / THROTTLE_INTERVAL_S)):
+        world.accelerate(throttle_at(k))
+        for _ in range(steps_per_throttle):
+            world.step(dt)
+        samples.append(world.position.copy())
+    runtime = time.perf_counter() - start
+    return samples, runtime
+
+
+def max_error(samples, reference):
+    return max(math.sqrt((a.x - b.x)**2 + (a.y - b.y)**2 + (a.z - b.z)**2) for a, b in zip(samples, reference))
+
+
+if __name__ == '__main__':
+    reference, _ = fly('rk4', REFERENCE_FPS)
+    print(f"{'integrator':>20} | {'fps':>5} | {'max pos error [m]':>17} | {'cpu per sim second [ms]':>23}")
+    for name in INTEGRATORS:
+        for fps in TEST_FPS:
+            samples, runtime = fly(name, fps)
+            print(f"{name:>20} | {fps:>5} | {max_error(samples, reference):>17.2e} | {runtime / DURATION_S * 1000:>23.3f}")
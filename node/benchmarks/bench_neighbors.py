@@ -0,0 +1,48 @@
+"""
+Cost of the neighbour queries of the collision avoidance at 100, 1k and 10k drones.
+
+Drones are spread uniformly in a cube sized so every drone has a handful of neighbours within the safety radius.
+The spatial hash (rebuild + query) is compared with a brute force O(N^2) distance matrix. Run from the node directory:
+
+    python benchmarks/bench_neighbors.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from collision import SpatialHash, CollisionAvoidance
+
+SAFETY_RADIUS = 1.0
+SPACING = 1.2
+REPEATS = 5
+
+
+def brute_force_pairs(positions, radius):
+    diff = positions[:, None, :] - positions[None, :, :]
+    dist = np.sqrt((diff ** 2).sum(axis=2))
+    return np.nonzero(np.triu(dist < radius, 1))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        result = fn()
+    return (time.perf_counter() - start) / REPEATS * 1000, result
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    print(f"{'drones':>7} | {'pairs':>7} | {'hash query [ms]':>15} | {'separation [ms]':>15} | {'brute force [ms]':>16}")
+    for n in (100, 1000, 10000):
+        positions = rng.uniform(0, n ** (1 / 3) * SPACING, (n, 3))
+        spatial_hash = SpatialHash(SAFETY_RADIUS)
+        hash_ms, pairs = timed(lambda: spatial_hash.build(positions).query_pairs(SAFETY_RADIUS))
+        avoidance = CollisionAvoidance(SAFETY_RADIUS)
+        separation_ms, _ = timed(lambda: avoidance.separation_throttle(positions))
+        # The distance matrix of 10k drones needs several GB
+        brute = f"{timed(lambda: brute_force_pairs(positions, SAFETY_RADIUS))[0]:>16.3f}" if n <= 2000 else f"{'-':>16}"
+        print(f"{n:>7} | {len(pairs[0]):>7} | {hash_ms:>15.3f} | {separation_ms:>15.3f} | {brute}")
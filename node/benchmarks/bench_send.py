@@ -0,0 +1,63 @@
+"""
+Send throughput of IPSender: messages per second for unicast position commands over loopback.
+
+The legacy sender resolves the own address and merges the header dicts on every send like IPSender did before the
+address was cached and the default headers were built once. Each variant runs with both wire formats, with and without
+coalescing. Nothing reads the receiving socket, datagrams that do not fit its buffer are dropped by the kernel. Run from
+the node directory:
+
+    python benchmarks/bench_send.py --messages 20000
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'middleware'))
+
+import WireFormat
+from IPCommunication import IPSender
+from Messaging import DefaultHeaders
+
+
+class LegacyHeaderSender(IPSender):
+    def _generate_default_header(self, destination_ip):
+        h_name = socket.gethostname()
+        return self.additional_default_headers | {DefaultHeaders.ORIGIN_IP: socket.gethostbyname(h_name),
+                                                  DefaultHeaders.UNICAST_PORT: self.uncast_port,
+                                                  DefaultHeaders.DESTINATION_IP: destination_ip,
+                                                  DefaultHeaders.UID: self.uid}
+
+
+def run(sender_cls, wire_format, flush_window_s, port, messages):
+    WireFormat.WIRE_FORMAT = wire_format
+    sender = sender_cls('224.1.1.1', 5007, port, None, str(uuid.uuid1()), flush_window_s=flush_window_s)
+    body = {'dest': {'x': 17.5, 'y': -4.25, 'z': 2.0}}
+    headers = {DefaultHeaders.TYPE: "NEW_POSITION"}
+    start = time.perf_counter()
+    for _ in range(messages):
+        sender.send_message_unicast('127.0.0.1', port, body, headers)
+    sender.flush()
+    elapsed = time.perf_counter() - start
+    return messages / elapsed, sender.datagrams_sent
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Droneworks send throughput benchmark")
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    port = sink.getsockname()[1]
+
+    print(f"{'sender':>8} | {'format':>6} | {'batching':>8} | {'msgs/s':>10} | {'datagrams':>9}")
+    for name, sender_cls in (('legacy', LegacyHeaderSender), ('cached', IPSender)):
+        for wire_format in ('json', 'binary'):
+            for flush_window_s in (0, 0.002):
+                rate, datagrams = run(sender_cls, wire_format, flush_window_s, port, args.messages)
+                print(f"{name:>8} | {wire_format:>6} | {'on' if flush_window_s else 'off':>8} | {rate:>10.0f} | "
+                      f"{datagrams:>9}")
@@ -0,0 +1,74 @@
+"""
+Checks that the collision avoidance keeps drones apart while they fly through each other.
+
+Two scenarios run in a HeadlessSimulation, once with the plain PID and once with CollisionAvoidance:
+    head-on  two rows of drones swap sides, every drone flies straight at its partner
+    shuffle  a grid of drones flies to a random permutation of the grid points
+
+The closest distance of any two drones is reported. The script fails if it drops below MIN_SEPARATION with the
+collision avoidance on. Run from the node directory:
+
+    python benchmarks/bench_separation.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from collision import CollisionAvoidance
+from engine import SwarmWorld, SwarmFlightController, HeadlessSimulation, C3d
+
+SAFETY_RADIUS = 1.0
+MIN_SEPARATION = SAFETY_RADIUS / 2
+DURATION_S = 30
+
+
+def head_on(n=40, spacing=1.5, distance=20.0):
+    half = n // 2
+    start = np.zeros((n, 3))
+    start[:half, 0] = -distance / 2
+    start[half:, 0] = distance / 2
+    start[:half, 1] = start[half:, 1] = np.arange(half) * spacing
+    destinations = start.copy()
+    destinations[:, 0] *= -1
+    return start, destinations
+
+
+def shuffle(n=100, spacing=2.0, seed=1):
+    k = int(np.ceil(n ** (1 / 3)))
+    start = np.stack(np.meshgrid(*[np.arange(k)] * 3), axis=-1).reshape(-1, 3)[:n] * spacing
+    return start.astype(float), np.random.default_rng(seed).permutation(start).astype(float)
+
+
+def min_separation(start, destinations, collision_avoidance):
+    swarm = SwarmWorld(len(start), weight=0.2, max_drone_force=C3d(1.5, 1.5, 1.5), start_positions=start,
+                       disable_lg=True)
+    fc = SwarmFlightController(swarm, start_destinations=destinations, collision_avoidance=collision_avoidance)
+    sim = HeadlessSimulation([swarm], [fc])
+    closest = np.inf
+    while sim.sim_time < DURATION_S:
+        sim.step()
+        diff = swarm.position[:, None, :] - swarm.position[None, :, :]
+        dist = np.sqrt((diff ** 2).sum(axis=2))
+        np.fill_diagonal(dist, np.inf)
+        closest = min(closest, dist.min())
+    return closest
+
+
+if __name__ == '__main__':
+    failed = []
+    print(f"{'scenario':>8} | {'drones':>6} | {'PID only [m]':>12} | {'avoidance [m]':>13} | {'time [s]':>8}")
+    for name, scenario in (('head-on', head_on), ('shuffle', shuffle)):
+        start, destinations = scenario()
+        without = min_separation(start, destinations, None)
+        t0 = time.perf_counter()
+        with_avoidance = min_separation(start, destinations, CollisionAvoidance(SAFETY_RADIUS))
+        elapsed = time.perf_counter() - t0
+        print(f"{name:>8} | {len(start):>6} | {without:>12.3f} | {with_avoidance:>13.3f} | {elapsed:>8.1f}")
+        if with_avoidance < MIN_SEPARATION:
+            failed.append(name)
+    if failed:
+        sys.exit(f"Drones came closer than {MIN_SEPARATION}m in: {', '.join(failed)}")
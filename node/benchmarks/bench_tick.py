@@ -0,0 +1,71 @@
+"""
+Micro-benchmark of a single physics + control tick of one drone.
+
+Compares the tick as it was written before the in-place C3d rework (every step deep-copies its operands) with the
+current World.step / FlightController.control_step. The old controller never parked, so parking is turned off here
+(arrival_tolerance=0) and every control_step runs the full PID instead of returning early once the drone arrived.
+Run from the node directory:
+
+    python benchmarks/bench_tick.py
+"""
+import copy
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine import World, FlightController, C3d
+
+
+def legacy_tick(world: World, fc: FlightController, integration: C3d, dt):
+    # Physics tick as done by the old World.__loop
+    f_w = copy.deepcopy(world.velocity).pow2_save_sign() * world.cw_A_rho
+    f_eff = copy.deepcopy(world._force) - f_w
+    world.acceleration = f_eff / world.weight
+    world.velocity = world.velocity + copy.deepcopy(world.acceleration) * dt
+    world.position = world.position + copy.deepcopy(world.velocity) * dt
+
+    # Control update as done by the old FlightController.__control_loop
+    rel_pos = copy.deepcopy(fc.destination) - copy.deepcopy(world.position)
+    integration = integration + copy.deepcopy(rel_pos)
+    throttle = copy.deepcopy(rel_pos) * fc.k_p + integration * fc.k_i + copy.deepcopy(world.velocity) * fc.k_d
+    throttle.min_max_norm(1)
+    world._force = copy.deepcopy(world.max_drone_force) * copy.deepcopy(throttle)
+    copy.deepcopy(rel_pos).close_to_zero(0.00001)
+    return integration
+
+
+def current_tick(world: World, fc: FlightController, dt):
+    world.step(dt)
+    fc.control_step()
+
+
+def make_drone(fps):
+    world = World(max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2, start_position=C3d(0, 0, 0), fps=fps, disable_lg=True)
+    fc = FlightController(world_ref=world, start_destination=C3d(10, -5, 3), arrival_tolerance=0)
+    return world, fc
+
+
+def measure(fps, legacy, duration_s=1.0):
+    world, fc = make_drone(fps)
+    dt = 1 / fps
+    integration = C3d(0, 0, 0)
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration_s:
+        for _ in range(100):
+            if legacy:
+                integration = legacy_tick(world, fc, integration, dt)
+            else:
+                current_tick(world, fc, dt)
+        ticks += 100
+    return ticks / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print(f"{'fps':>6} | {'variant':>8} | {'ticks/s':>10} | {'budget used at fps':>18}")
+    for fps in (100, 1000):
+        for legacy in (True, False):
+            rate = measure(fps, legacy)
+            print(f"{fps:>6} | {'before' if legacy else 'after':>8} | {rate:>10.0f} | {fps / rate * 100:>17.3f}%")
@@ -0,0 +1,68 @@
+"""
+Bytes per datagram and encode/decode time per message of the JSON and the binary wire format.
+
+The messages are built like the middleware builds them: a heartbeat multicast with the acks of a swarm of peers (with
+the full-precision payload the nodes sent before the telemetry codec, and with a telemetry keyframe and delta), a
+NEW_POSITION unicast of the leader and a negative ack. Run from the node directory:
+
+    python benchmarks/bench_wire.py --peers 10
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'middleware'))
+
+from Messaging import Message, DefaultHeaders, DefaultMessageTypes
+from WireFormat import encode_message, decode_message, register_message_type
+from telemetry import TelemetryEncoder
+
+REPEATS = 20000
+
+
+def default_header(destination_ip):
+    return {DefaultHeaders.ORIGIN_IP: '172.17.0.12', DefaultHeaders.UNICAST_PORT: 5008,
+            DefaultHeaders.DESTINATION_IP: destination_ip, DefaultHeaders.UID: str(uuid.uuid1())}
+
+
+def sample_messages(peers):
+    register_message_type("NEW_POSITION", 64)
+    acks = {str(uuid.uuid1()): 1000 + i for i in range(peers)}
+    heartbeat_header = {DefaultHeaders.TYPE: DefaultMessageTypes.HEARTBEAT, DefaultHeaders.READABLE_NAME: "Jane Doe"} \
+        | default_header('224.1.1.1')
+    pos, vel, acc = {'x': 12.345678, 'y': -3.2109876, 'z': 2.0000001}, {'x': 0.123, 'y': -0.456, 'z': 0.0}, \
+        {'x': 0.01, 'y': 0.02, 'z': -0.03}
+    heartbeat = Message(heartbeat_header, {"pos": pos, "vel": vel, "acc": acc}, seq=4711, acks=acks)
+    telemetry = TelemetryEncoder()
+    keyframe = Message(heartbeat_header, telemetry.encode(pos, vel, acc), seq=4711, acks=acks)
+    moved = {'x': 12.468678, 'y': -3.6669876, 'z': 2.0000001}
+    delta = Message(heartbeat_header, telemetry.encode(moved, vel, acc), seq=4712, acks=acks)
+    new_position = Message({DefaultHeaders.TYPE: "NEW_POSITION"} | default_header('172.17.0.13'),
+                           {'dest': {'x': 17.5, 'y': -4.25, 'z': 2.0}})
+    negative_ack = Message({DefaultHeaders.TYPE: DefaultMessageTypes.NEGATIVE_ACK} | default_header('172.17.0.13'), 4710)
+    return [('heartbeat', heartbeat), ('hb_keyframe', keyframe), ('hb_delta', delta), ('new_position', new_position),
+            ('negative_ack', negative_ack)]
+
+
+def time_us(fn):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn()
+    return (time.perf_counter() - start) / REPEATS * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Droneworks wire format benchmark")
+    parser.add_argument('--peers', type=int, default=10, help="Number of acks piggybacked on the heartbeat")
+    args = parser.parse_args()
+
+    print(f"{'message':>13} | {'format':>6} | {'bytes':>6} | {'encode [us]':>11} | {'decode [us]':>11}")
+    for name, message in sample_messages(args.peers):
+        for wire_format in ('json', 'binary'):
+            data = encode_message(message, wire_format)
+            encode = time_us(lambda: encode_message(message, wire_format))
+            decode = time_us(lambda: decode_message(data))
+            print(f"{name:>13} | {wire_format:>6} | {len(data):>6} | {encode:>11.2f} | {decode:>11.2f}")
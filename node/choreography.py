@@ -0,0 +1,165 @@
+
+import numpy as np
+
+from assignment import assign_targets
+from shape_logic import load_shape, DEFAULT_BOUNDS, DEFAULT_MIN_SPACING
+from middleware.Logger import lg
+from middleware.WireFormat import uid_to_bytes
+
+# Formation targets travel as integer centimeters
+FORMATION_RESOLUTION = 0.01
+
+_FORMATION_UID = np.dtype('V16')
+_FORMATION_TARGET = np.dtype('>i4')
+_FORMATION_ENTRY_BYTES = _FORMATION_UID.itemsize + 3 * _FORMATION_TARGET.itemsize
+
+
+"""
+One formation of a show. The swarm flies to the shape, and once it has converged (or timeout_s passed) it holds the
+formation for hold_s before the next step is dispatched.
+"""
+class ShowStep:
+    def __init__(self, shape, hold_s=0.0, timeout_s=None, height_level=2, bounds=DEFAULT_BOUNDS,
+                 min_spacing=DEFAULT_MIN_SPACING):
+        self.shape = shape
+        self.hold_s = hold_s
+        self.timeout_s = timeout_s
+        self.height_level = height_level
+        self.bounds = bounds
+        self.min_spacing = min_spacing
+
+    def __str__(self):
+        timeout = f"{self.timeout_s}s" if self.timeout_s is not None else "none"
+        return f"{self.shape} (hold {self.hold_s}s, timeout {timeout})"
+
+
+"""
+A show with all destinations computed up front. destinations[k] is an (N,3) array with the target of every drone in
+step k, each step is assigned from the formation of the previous one. A looping show is compiled for two passes, the
+second pass starts from the last formation and is the one that is repeated.
+"""
+class CompiledShow:
+    def __init__(self, steps, destinations, loop_start=None):
+        self.steps = steps
+        self.destinations = destinations
+        self.loop_start = loop_start
+
+    def __len__(self):
+        return len(self.destinations)
+
+    def step(self, index):
+        return self.steps[index % len(self.steps)]
+
+    def next_index(self, index):
+        # None at the end of a show that does not loop
+        if index + 1 < len(self.destinations):
+            return index + 1
+        return self.loop_start
+
+
+def compile_show(steps, start_positions, loop=False, method='auto'):
+    if not steps:
+        raise ValueError("A show needs at least one step")
+    previous = np.asarray(start_positions, dtype=float)
+    destinations = []
+    for step in steps * (2 if loop else 1):
+        targets = load_shape(step.shape, step.height_level, step.bounds, step.min_spacing).get_position_array(
+            len(previous))
+        previous = targets[assign_targets(previous, targets, method)]
+        previous.flags.writeable = False
+        destinations.append(previous)
+    return CompiledShow(steps, destinations, loop_start=len(steps) if loop else None)
+
+
+"""
+The body of a formation message: one table with the target of every drone, sent once to the whole swarm as a single
+bytes value. The 16 byte uids of all drones (the uid encoding of the wire format) come first, followed by the targets in
+the same order as three big endian int32 centimeters each, 28 bytes per drone. Every node looks up its own destination
+with formation_destination.
+"""
+def encode_formation(uids, destinations):
+    quantized = np.rint(np.asarray(destinations, dtype=float) / FORMATION_RESOLUTION).astype(_FORMATION_TARGET)
+    if quantized.shape != (len(uids), 3):
+        raise ValueError(f"Need one destination per uid, got {len(uids)} uids and {len(quantized)} destinations")
+    return b''.join(uid_to_bytes(str(uid)) for uid in uids) + quantized.tobytes()
+
+
+def formation_destination(formation, uid):
+    if len(formation) % _FORMATION_ENTRY_BYTES:
+        raise ValueError(f"Formation of {len(formation)} bytes is not a table of {_FORMATION_ENTRY_BYTES} byte entries")
+    n = len(formation) // _FORMATION_ENTRY_BYTES
+    uids = np.frombuffer(formation, dtype=_FORMATION_UID, count=n)
+    index = np.flatnonzero(uids == np.void(uid_to_bytes(uid)))
+    if len(index) == 0:
+        return None
+    targets = np.frombuffer(formation, dtype=_FORMATION_TARGET, count=3 * n, offset=n * _FORMATION_UID.itemsize)
+    return (targets[3 * index[0]:3 * index[0] + 3] * FORMATION_RESOLUTION).tolist()
+
+
+"""
+Plays a compiled show on a TickScheduler. dispatch(index, destinations) sends the drones of a step to their targets,
+converged(destinations) tells whether the swarm has reached them. Both are called from the scheduler loop, the
+assignment work was done by compile_show so dispatching is only sending.
+"""
+class ChoreographyPlayer:
+    TRANSITION = 'transition'
+    HOLD = 'hold'
+
+    def __init__(self, show: CompiledShow, dispatch, converged, scheduler, poll_interval_s=0.1, on_finished=None):
+        self.show = show
+        self.dispatch = dispatch
+        self.converged = converged
+        self.scheduler = scheduler
+        self.poll_interval_s = poll_interval_s
+        self.on_finished = on_finished
+
+        self.index = None
+        self.phase = None
+        self.phase_started = 0.0
+        self.task = None
+
+    def __str__(self):
+        if self.phase is None:
+            return "Show: stopped"
+        return f"Show: step {self.index + 1}/{len(self.show)} {self.show.step(self.index)} | {self.phase}"
+
+    @property
+    def running(self):
+        return self.task is not None
+
+    def start(self):
+        self.stop()
+        self._dispatch(0)
+        self.task = self.scheduler.add_periodic("choreography", self.poll_interval_s, self._tick,
+                                                start_delay_s=self.poll_interval_s)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.phase = None
+
+    def _dispatch(self, index):
+        self.index = index
+        self.phase = self.TRANSITION
+        self.phase_started = self.scheduler.clock()
+        lg.info(f"Show step {index + 1}/{len(self.show)}: {self.show.step(index)}")
+        self.dispatch(index, self.show.destinations[index])
+
+    def _tick(self):
+        now = self.scheduler.clock()
+        step = self.show.step(self.index)
+        if self.phase == self.TRANSITION:
+            if self.converged(self.show.destinations[self.index]):
+                self.phase, self.phase_started = self.HOLD, now
+            elif step.timeout_s is not None and now - self.phase_started > step.timeout_s:
+                lg.warning(f"Show step {self.index + 1} did not converge within {step.timeout_s}s, continuing")
+                self.phase, self.phase_started = self.HOLD, now
+        if self.phase == self.HOLD and now - self.phase_started >= step.hold_s:
+            next_index = self.show.next_index(self.index)
+            if next_index is None:
+                self.stop()
+                if self.on_finished is not None:
+                    self.on_finished()
+            else:
+                self._dispatch(next_index)
@@ -0,0 +1,128 @@
+import numpy as np
+
+# Cell coordinates are packed into one int64 key, 21 bits per axis
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+
+# Same cell plus 13 of the 26 neighbours, every unordered pair of cells is visited exactly once
+_HALF_NEIGHBOURHOOD = [(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                       if (dx, dy, dz) > (0, 0, 0)]
+
+
+def _cell_keys(cells):
+    c = (cells + _KEY_OFFSET) & _KEY_MASK
+    return (c[:, 0] << (2 * _KEY_BITS)) | (c[:, 1] << _KEY_BITS) | c[:, 2]
+
+
+"""
+Uniform grid spatial hash over the drone positions. It is rebuilt from scratch every tick (one sort), neighbour queries
+only compare drones in adjacent cells so the cost stays close to O(N) as long as the swarm is not packed into a few
+cells.
+"""
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.positions = None
+        self._order = None
+        self._keys = None
+        self._starts = None
+        self._counts = None
+        self._point_cells = None
+
+    def build(self, positions):
+        self.positions = positions
+        self._point_cells = np.floor(positions / self.cell_size).astype(np.int64)
+        keys = _cell_keys(self._point_cells)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys, self._starts, self._counts = np.unique(keys[self._order], return_index=True, return_counts=True)
+        return self
+
+    def _cell_members(self, cell_keys):
+        # Start and size of the given cells in the sorted order, empty cells have size 0
+        idx = np.searchsorted(self._keys, cell_keys)
+        idx_clipped = np.minimum(idx, len(self._keys) - 1)
+        found = self._keys[idx_clipped] == cell_keys
+        return np.where(found, self._starts[idx_clipped], 0), np.where(found, self._counts[idx_clipped], 0)
+
+    def _candidate_pairs(self):
+        n = len(self.positions)
+        own_start = np.repeat(self._starts, self._counts)
+        own_rank = np.arange(n) - own_start
+        own_count = np.repeat(self._counts, self._counts)
+
+        sources = []
+        targets = []
+        # Pairs inside the own cell, j after i in the sorted order
+        self._expand(np.arange(n), own_start + own_rank + 1, own_count - own_rank - 1, sources, targets)
+        # Pairs with the neighbour cells
+        cells = self._point_cells[self._order]
+        for offset in _HALF_NEIGHBOURHOOD:
+            starts, counts = self._cell_members(_cell_keys(cells + offset))
+            self._expand(np.arange(n), starts, counts, sources, targets)
+
+        if not sources:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        sorted_i = np.concatenate(sources)
+        sorted_j = np.concatenate(targets)
+        return self._order[sorted_i], self._order[sorted_j]
+
+    @staticmethod
+    def _expand(points, starts, counts, sources, targets):
+        # For every point emit (point, starts + k) for k in range(count)
+        total = int(counts.sum())
+        if total == 0:
+            return
+        sources.append(np.repeat(points, counts))
+        run_offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        targets.append(np.repeat(starts, counts) + run_offsets)
+
+    def query_pairs(self, radius):
+        if radius > self.cell_size:
+            raise ValueError(f"Query radius {radius} is larger than the cell size {self.cell_size}")
+        if self.positions is None or len(self.positions) < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros((0, 3)), np.zeros(0)
+        i, j = self._candidate_pairs()
+        diff = self.positions[i] - self.positions[j]
+        dist = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+        close = dist < radius
+        return i[close], j[close], diff[close], dist[close]
+
+
+"""
+Separation layer on top of the controller output. Drones closer than the safety radius push each other apart with a
+throttle that grows linearly from 0 at the radius to max_throttle at contact. The SwarmFlightController scales its
+clamped PID output down by the separation a drone gets, so once the push reaches full throttle it is all that is left.
+
+With velocities the distances are taken between the positions the drones reach in lookahead_s. The controller only
+updates every 100ms and two drones flying at each other at full speed close in by most of the safety radius within
+one update, so without the lookahead they react too late.
+"""
+class CollisionAvoidance:
+    def __init__(self, safety_radius=1.0, max_throttle=3.0, lookahead_s=0.2):
+        self.safety_radius = safety_radius
+        self.max_throttle = max_throttle
+        self.lookahead_s = lookahead_s
+        self.spatial_hash = SpatialHash(cell_size=safety_radius)
+        self.close_pairs = 0
+
+    def separation_throttle(self, positions, velocities=None):
+        n = len(positions)
+        if velocities is not None:
+            positions = positions + velocities * self.lookahead_s
+        i, j, diff, dist = self.spatial_hash.build(positions).query_pairs(self.safety_radius)
+        self.close_pairs = len(i)
+
+        # Coincident drones have no direction to push in, separate them along x
+        coincident = dist < 1e-9
+        diff[coincident] = (1e-9, 0, 0)
+        dist[coincident] = 1e-9
+        strength = self.max_throttle * (1 - dist / self.safety_radius) / dist
+        push = diff * strength[:, None]
+
+        throttle = np.zeros((n, 3))
+        for axis in range(3):
+            throttle[:, axis] = np.bincount(i, push[:, axis], minlength=n) - np.bincount(j, push[:, axis], minlength=n)
+        return throttle
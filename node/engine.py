@@ -1,11 +1,19 @@
-import copy
 from middleware.Logger import lg
+from concurrent.futures import Future
 import threading
 import time
 import numpy as np
 
+from trajectory import TrajectoryRecorder
 
+
+"""
+Three dimensional vector. The operators return new vectors, the named methods (iadd, isub, imul, idiv, ...) work in
+place and return self so they can be chained in the simulation loops without allocating.
+"""
 class C3d:
+    __slots__ = ('x', 'y', 'z')
+
     def __init__(self, *args):
         if len(args) != 0:
             if isinstance(args[0], dict):
@@ -23,47 +31,82 @@ class C3d:
             self.y = 0
             self.z = 0
 
-    def __floordiv__(self, other):
-        self.x = self.x / other
-        self.y = self.y / other
-        self.z = self.z / other
-        return self
+    # Non-mutating operators
+    def __add__(self, other):
+        return C3d(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return C3d(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, other):
+        if isinstance(other, C3d):
+            return C3d(self.x * other.x, self.y * other.y, self.z * other.z)
+        return C3d(self.x * other, self.y * other, self.z * other)
+
+    __rmul__ = __mul__
 
     def __truediv__(self, other):
-        self.x = self.x / other
-        self.y = self.y / other
-        self.z = self.z / other
-        return self
+        return C3d(self.x / other, self.y / other, self.z / other)
+
+    # Like the original Vec3, // divides and does not floor
+    __floordiv__ = __truediv__
 
     def __pow__(self, power, modulo=None):
-        self.x = self.x**power
-        self.y = self.y**power
-        self.z = self.z**power
+        return C3d(self.x**power, self.y**power, self.z**power)
+
+    def __neg__(self):
+        return C3d(-self.x, -self.y, -self.z)
+
+    # In-place variants
+    def set(self, other):
+        self.x = other.x
+        self.y = other.y
+        self.z = other.z
         return self
 
-    def __mul__(self, other):
-        if type(other) == type(self):
-            self.x = self.x * other.x
-            self.y = self.y * other.y
-            self.z = self.z * other.z
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def isub(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+
+    def imul(self, other):
+        if isinstance(other, C3d):
+            self.x *= other.x
+            self.y *= other.y
+            self.z *= other.z
         else:
-            self.x = self.x * other
-            self.y = self.y * other
-            self.z = self.z * other
+            self.x *= other
+            self.y *= other
+            self.z *= other
         return self
 
-    def __sub__(self, other):
-        self.x = self.x - other.x
-        self.y = self.y - other.y
-        self.z = self.z - other.z
+    def idiv(self, other):
+        self.x /= other
+        self.y /= other
+        self.z /= other
         return self
 
-    def __add__(self, other):
-        self.x = self.x + other.x
-        self.y = self.y + other.y
-        self.z = self.z + other.z
+    def iadd_scaled(self, other, factor):
+        self.x += other.x * factor
+        self.y += other.y * factor
+        self.z += other.z * factor
         return self
 
+    __iadd__ = iadd
+    __isub__ = isub
+    __imul__ = imul
+    __itruediv__ = idiv
+
+    def copy(self):
+        return C3d(self.x, self.y, self.z)
+
     def min_max_norm(self, norm):
         self.x = min(self.x, norm)
         self.y = min(self.y, norm)
@@ -74,26 +117,23 @@ class C3d:
         return self
 
     def pow2_save_sign(self):
-        if self.x < 0:
-            self.x = -1*self.x**2
-        else:
-            self.x = self.x**2
-        if self.y < 0:
-            self.y = -1*self.y**2
-        else:
-            self.y = self.y**2
-        if self.z < 0:
-            self.z = -1*self.z**2
-        else:
-            self.z = self.z**2
+        self.x = self.x * abs(self.x)
+        self.y = self.y * abs(self.y)
+        self.z = self.z * abs(self.z)
         return self
 
     def to_numpy_array(self):
         return np.array([self.x, self.y, self.z])
 
+    def to_dict(self):
+        return {'x': self.x, 'y': self.y, 'z': self.z}
+
     def __str__(self):
         return f"X: {self.x}\tY: {self.y}\tZ: {self.z}"
 
+    def __repr__(self):
+        return f"C3d({self.x}, {self.y}, {self.z})"
+
     def __eq__(self, other):
         return self.x==other.x and self.y==other.y and self.z==other.z
 
@@ -101,59 +141,255 @@ class C3d:
         return abs(self.x) < epsilon and abs(self.y) < epsilon and abs(self.z) < epsilon
 
 
+"""
+Fixed timestep clock. Elapsed wall time is collected in an accumulator and consumed in steps of dt. Steps that were
+missed because the loop woke up late are caught up on the next tick (at most max_catch_up_steps at once), everything
+beyond that is dropped so the simulation does not spiral when the host is overloaded. time_source is read instead of
+the wall clock, a scheduler running on simulated time hands in its clock.
+"""
+class SimulationClock:
+    def __init__(self, dt, max_catch_up_steps=5, time_source=time.monotonic):
+        self.dt = dt
+        self.max_catch_up_steps = max_catch_up_steps
+        self.time_source = time_source
+        self.sim_time = 0.0
+        self.steps = 0
+        self.late_steps = 0
+        self.dropped_steps = 0
+        self._accumulator = dt
+        self._last_wall_time = None
+
+    def __str__(self):
+        return f"Sim time: {round(self.sim_time, ndigits=3)} | Steps: {self.steps} | Late: {self.late_steps} | Dropped: {self.dropped_steps}"
+
+    def due_steps(self):
+        now = self.time_source()
+        if self._last_wall_time is not None:
+            self._accumulator += now - self._last_wall_time
+        self._last_wall_time = now
+
+        steps = int(self._accumulator / self.dt)
+        if steps > self.max_catch_up_steps:
+            dropped = steps - self.max_catch_up_steps
+            self.dropped_steps += dropped
+            self._accumulator -= dropped * self.dt
+            steps = self.max_catch_up_steps
+        if steps > 1:
+            self.late_steps += steps - 1
+        return steps
+
+    def advance(self, step_fn):
+        steps = self.due_steps()
+        for _ in range(steps):
+            step_fn(self.dt)
+            self._accumulator -= self.dt
+            self.sim_time += self.dt
+            self.steps += 1
+        return steps
+
+    def set_dt(self, dt, step_now=False):
+        self.dt = dt
+        if step_now:
+            self._accumulator = dt
+            self._last_wall_time = self.time_source()
+        else:
+            self._accumulator = min(self._accumulator, dt)
+
+    def time_until_next_step(self):
+        return max(0.0, self.dt - self._accumulator - (self.time_source() - self._last_wall_time))
+
+
+"""
+Integrators advance the state of a body (World or SwarmWorld) by one timestep. They only use the vector primitives of
+the body (new_vector, assign, axpy, compute_acceleration), so the same code steps a single C3d based World and the
+array based SwarmWorld. Scratch vectors are created once per body, a step does not allocate.
+"""
+class Integrator:
+    name = None
+
+    def __init__(self, body):
+        self.body = body
+
+    def step(self, dt):
+        raise NotImplementedError
+
+
+class ExplicitEuler(Integrator):
+    name = 'explicit_euler'
+
+    def step(self, dt):
+        b = self.body
+        b.compute_acceleration(b.velocity, b.acceleration)
+        b.axpy(b.position, b.velocity, dt)
+        b.axpy(b.velocity, b.acceleration, dt)
+
+
+class SemiImplicitEuler(Integrator):
+    name = 'semi_implicit_euler'
+
+    def step(self, dt):
+        b = self.body
+        b.compute_acceleration(b.velocity, b.acceleration)
+        b.axpy(b.velocity, b.acceleration, dt)
+        b.axpy(b.position, b.velocity, dt)
+
+
+class VelocityVerlet(Integrator):
+    name = 'velocity_verlet'
+
+    def __init__(self, body):
+        super().__init__(body)
+        self._v_pred = body.new_vector()
+        self._a_new = body.new_vector()
+
+    def step(self, dt):
+        b = self.body
+        b.compute_acceleration(b.velocity, b.acceleration)
+        b.axpy(b.position, b.velocity, dt)
+        b.axpy(b.position, b.acceleration, dt * dt / 2)
+
+        # Drag depends on the velocity, so the new acceleration is evaluated at a predicted velocity
+        b.assign(self._v_pred, b.velocity)
+        b.axpy(self._v_pred, b.acceleration, dt)
+        b.compute_acceleration(self._v_pred, self._a_new)
+
+        b.axpy(b.velocity, b.acceleration, dt / 2)
+        b.axpy(b.velocity, self._a_new, dt / 2)
+        b.assign(b.acceleration, self._a_new)
+
+
+class RK4(Integrator):
+    name = 'rk4'
+
+    def __init__(self, body):
+        super().__init__(body)
+        self._k = [body.new_vector() for _ in range(4)]
+        self._v = [body.new_vector() for _ in range(3)]
+
+    def step(self, dt):
+        b = self.body
+        k1, k2, k3, k4 = self._k
+        v2, v3, v4 = self._v
+
+        b.compute_acceleration(b.velocity, k1)
+        b.assign(v2, b.velocity)
+        b.axpy(v2, k1, dt / 2)
+        b.compute_acceleration(v2, k2)
+        b.assign(v3, b.velocity)
+        b.axpy(v3, k2, dt / 2)
+        b.compute_acceleration(v3, k3)
+        b.assign(v4, b.velocity)
+        b.axpy(v4, k3, dt)
+        b.compute_acceleration(v4, k4)
+
+        # The position derivative of each stage is the stage velocity
+        b.axpy(b.position, b.velocity, dt / 6)
+        b.axpy(b.position, v2, dt / 3)
+        b.axpy(b.position, v3, dt / 3)
+        b.axpy(b.position, v4, dt / 6)
+
+        b.axpy(b.velocity, k1, dt / 6)
+        b.axpy(b.velocity, k2, dt / 3)
+        b.axpy(b.velocity, k3, dt / 3)
+        b.axpy(b.velocity, k4, dt / 6)
+        b.assign(b.acceleration, k1)
+
+
+INTEGRATORS = {cls.name: cls for cls in (ExplicitEuler, SemiImplicitEuler, VelocityVerlet, RK4)}
+
+
+def make_integrator(name, body):
+    if name not in INTEGRATORS:
+        raise ValueError(f"Unknown integrator {name}. Available: {', '.join(INTEGRATORS)}")
+    return INTEGRATORS[name](body)
+
+
 class World:
-    def __init__(self, weight: float, start_position: C3d, max_drone_force: C3d, fps=100, cw_a_rho=0.3, disable_lg=False):
+    def __init__(self, weight: float, start_position: C3d, max_drone_force: C3d, fps=100, cw_a_rho=0.3, disable_lg=False,
+                 max_catch_up_steps=5, integrator='semi_implicit_euler', recorder_capacity=None):
         self.weight = weight
         self.max_drone_force = max_drone_force
-        self.position = start_position
+        self.position = start_position.copy()
         self.acceleration = C3d(0, 0, 0)
         self.velocity = C3d(0, 0, 0)
         self._force = C3d(0, 0, 0)
+        # Scratch vectors reused every tick
+        self._f_w = C3d(0, 0, 0)
+        self._step_force = C3d(0, 0, 0)
+        self.integrator = make_integrator(integrator, self)
+        self.sim_time = 0.0
+        self.recorder = TrajectoryRecorder(recorder_capacity) if recorder_capacity else None
         self.fps = fps
         self.cw_A_rho = cw_a_rho
+        self.clock = SimulationClock(1/fps, max_catch_up_steps)
         self.thread = None
+        self.task = None
+        self._lg_counter = 0
         self.force_lock = threading.Lock()
         self.do_lg = True
         self.global_lg_disabled = disable_lg
 
     def __str__(self):
-        return f"Position: {self.position}<br>Velocity: {self.velocity}<br>Acceleration: {self.acceleration}"
+        return f"Position: {self.position}<br>Velocity: {self.velocity}<br>Acceleration: {self.acceleration}<br>Clock: {self.clock}"
 
-    def __loop(self):
-        counter = 0
-        while True:
-            timestamp = time.time()
-            f_w = copy.deepcopy(self.velocity).pow2_save_sign() * self.cw_A_rho
-
-            self.force_lock.acquire()
-            f_eff = copy.deepcopy(self._force) - f_w
-            self.force_lock.release()
-
-            self.acceleration = f_eff/self.weight
-            self.velocity += copy.deepcopy(self.acceleration) * 1/self.fps
-            self.position += copy.deepcopy(self.velocity) * 1/self.fps
-
-            runtime = (time.time()-timestamp)
-            if counter > 10:
-                if self.do_lg and not self.global_lg_disabled:
-                    lg.debug(f"Acceleration: X: {round(self.acceleration.x, ndigits=5)} | Y: {round(self.acceleration.y, ndigits=5)} "
-                                 f"| Z: {round(self.acceleration.z, ndigits=5)} |||  Velocity X: {round(self.velocity.x, ndigits=3)} | Y: {round(self.velocity.y, ndigits=3)} | "
-                                f"Z: {round(self.velocity.z, ndigits=3)} ||| Position X: {round(self.position.x, ndigits=3)} | "
-                                f"Y: {round(self.position.y, ndigits=3)} | Z: {round(self.position.z, ndigits=3)} | Runtime[ms]: {runtime*1000}")
-                counter = 0
-            else:
-                counter += 1
+    def step(self, dt):
+        # The drone force is constant during a step
+        self.force_lock.acquire()
+        self._step_force.set(self._force)
+        self.force_lock.release()
 
-            sleeptime = 1/self.fps - runtime
-            if sleeptime < 0:
-                lg.error("The physics simulation is overloaded. Please buy better hardware. Thanks.")
-            else:
-                time.sleep(1/self.fps - runtime)
+        self.integrator.step(dt)
+        self.sim_time += dt
+        if self.recorder is not None:
+            self.recorder.record_c3d(self.sim_time, self.position, self.velocity, self.acceleration, self._step_force)
+
+    # Vector primitives used by the integrators
+    def compute_acceleration(self, velocity: C3d, out: C3d):
+        f_w = self._f_w.set(velocity).pow2_save_sign().imul(self.cw_A_rho)
+        return out.set(self._step_force).isub(f_w).idiv(self.weight)
+
+    def new_vector(self):
+        return C3d(0, 0, 0)
+
+    @staticmethod
+    def assign(dst: C3d, src: C3d):
+        dst.set(src)
+
+    @staticmethod
+    def axpy(dst: C3d, src: C3d, factor):
+        dst.iadd_scaled(src, factor)
+
+    def tick(self):
+        timestamp = time.time()
+        dropped = self.clock.dropped_steps
+        self.clock.advance(self.step)
+
+        runtime = (time.time()-timestamp)
+        if self._lg_counter > 10:
+            if self.do_lg and not self.global_lg_disabled:
+                lg.debug(f"Acceleration: X: {round(self.acceleration.x, ndigits=5)} | Y: {round(self.acceleration.y, ndigits=5)} "
+                             f"| Z: {round(self.acceleration.z, ndigits=5)} |||  Velocity X: {round(self.velocity.x, ndigits=3)} | Y: {round(self.velocity.y, ndigits=3)} | "
+                            f"Z: {round(self.velocity.z, ndigits=3)} ||| Position X: {round(self.position.x, ndigits=3)} | "
+                            f"Y: {round(self.position.y, ndigits=3)} | Z: {round(self.position.z, ndigits=3)} | Runtime[ms]: {runtime*1000}")
+            self._lg_counter = 0
+        else:
+            self._lg_counter += 1
+
+        if self.clock.dropped_steps != dropped:
+            lg.error("The physics simulation is overloaded. Please buy better hardware. Thanks.")
 
-    def run_simulation(self):
+    def __loop(self):
+        while True:
+            self.tick()
+            time.sleep(self.clock.time_until_next_step())
+
+    def run_simulation(self, scheduler=None):
+        if scheduler is not None:
+            self.clock.time_source = scheduler.clock
+            self.task = scheduler.add_periodic("physics", 1/self.fps, self.tick)
+            return
         self.thread = threading.Thread(target=self.__loop, daemon=True)
         self.thread.start()
-        pass
 
     def stop_simulation(self):
         pass
@@ -161,22 +397,245 @@ class World:
     def accelerate(self, throttle: C3d):
         throttle.min_max_norm(1)
         self.force_lock.acquire()
-        self._force = copy.deepcopy(self.max_drone_force) * copy.deepcopy(throttle)
+        self._force.set(self.max_drone_force).imul(throttle)
         self.force_lock.release()
 
 
+"""
+Physics for a whole swarm. The state of all drones is kept in (N,3) arrays and drag, acceleration and integration are
+computed for every drone in one vectorized tick, so there is a single physics thread no matter how big the swarm is.
+"""
+class SwarmWorld:
+    def __init__(self, n_drones: int, weight, max_drone_force, start_positions=None, fps=100, cw_a_rho=0.3, disable_lg=False,
+                 max_catch_up_steps=5, integrator='semi_implicit_euler', recorder_capacity=None):
+        self.n_drones = n_drones
+        # Weight and max force may be given for the whole swarm or per drone
+        self.weight = np.broadcast_to(np.asarray(weight, dtype=float).reshape(-1, 1), (n_drones, 1)).copy()
+        self.max_drone_force = self._to_array(max_drone_force)
+        if start_positions is None:
+            self.position = np.zeros((n_drones, 3))
+        else:
+            self.position = self._to_array(start_positions)
+        self.velocity = np.zeros((n_drones, 3))
+        self.acceleration = np.zeros((n_drones, 3))
+        self.force = np.zeros((n_drones, 3))
+        self.fps = fps
+        self.cw_A_rho = cw_a_rho
+        self.clock = SimulationClock(1/fps, max_catch_up_steps)
+        self.thread = None
+        self.task = None
+        self._lg_counter = 0
+        self.force_lock = threading.Lock()
+        self.do_lg = True
+        self.global_lg_disabled = disable_lg
+
+        # Scratch buffers so a tick does not allocate temporary arrays
+        self._drag_buf = np.zeros((n_drones, 3))
+        self._axpy_buf = np.zeros((n_drones, 3))
+        self._step_force = np.zeros((n_drones, 3))
+        self.integrator = make_integrator(integrator, self)
+        self.sim_time = 0.0
+        self.recorder = TrajectoryRecorder(recorder_capacity, n_drones) if recorder_capacity else None
+
+        self.drones = [SwarmDrone(self, i) for i in range(n_drones)]
+
+    def _to_array(self, value):
+        if isinstance(value, C3d):
+            return np.tile(value.to_numpy_array().astype(float), (self.n_drones, 1))
+        if len(value) > 0 and isinstance(value[0], C3d):
+            return np.array([c.to_numpy_array() for c in value], dtype=float)
+        return np.broadcast_to(np.asarray(value, dtype=float), (self.n_drones, 3)).copy()
+
+    def __str__(self):
+        return f"Drones: {self.n_drones}<br>FPS: {self.fps}<br>Clock: {self.clock}"
+
+    def __getitem__(self, index):
+        return self.drones[index]
+
+    def __len__(self):
+        return self.n_drones
+
+    def step(self, dt):
+        # The drone forces are constant during a step
+        with self.force_lock:
+            np.copyto(self._step_force, self.force)
+
+        self.integrator.step(dt)
+        self.sim_time += dt
+        if self.recorder is not None:
+            self.recorder.record_arrays(self.sim_time, self.position, self.velocity, self.acceleration, self._step_force)
+
+    # Vector primitives used by the integrators
+    def compute_acceleration(self, velocity, out):
+        # Air resistance with the sign of the velocity: f_w = v * |v| * cw_A_rho
+        f_w = self._drag_buf
+        np.multiply(velocity, np.abs(velocity, out=f_w), out=f_w)
+        f_w *= self.cw_A_rho
+        np.subtract(self._step_force, f_w, out=out)
+        out /= self.weight
+        return out
+
+    def new_vector(self):
+        return np.zeros((self.n_drones, 3))
+
+    @staticmethod
+    def assign(dst, src):
+        np.copyto(dst, src)
+
+    def axpy(self, dst, src, factor):
+        np.multiply(src, factor, out=self._axpy_buf)
+        dst += self._axpy_buf
+
+    def tick(self):
+        timestamp = time.time()
+        dropped = self.clock.dropped_steps
+        self.clock.advance(self.step)
+
+        runtime = (time.time()-timestamp)
+        if self._lg_counter > 10:
+            if self.do_lg and not self.global_lg_disabled:
+                lg.debug(f"Swarm of {self.n_drones} | Max velocity: {round(float(np.abs(self.velocity).max(initial=0)), ndigits=3)} "
+                         f"| Runtime[ms]: {runtime*1000}")
+            self._lg_counter = 0
+        else:
+            self._lg_counter += 1
+
+        if self.clock.dropped_steps != dropped:
+            lg.error("The physics simulation is overloaded. Please buy better hardware. Thanks.")
+
+    def __loop(self):
+        while True:
+            self.tick()
+            time.sleep(self.clock.time_until_next_step())
+
+    def run_simulation(self, scheduler=None):
+        # Drone views forward to this method, so only the first call starts the loop
+        if self.thread is not None or self.task is not None:
+            return
+        if scheduler is not None:
+            self.clock.time_source = scheduler.clock
+            self.task = scheduler.add_periodic("physics", 1/self.fps, self.tick)
+            return
+        self.thread = threading.Thread(target=self.__loop, daemon=True)
+        self.thread.start()
+
+    def stop_simulation(self):
+        pass
+
+    def accelerate(self, index, throttle: C3d):
+        throttle.min_max_norm(1)
+        with self.force_lock:
+            self.force[index, 0] = self.max_drone_force[index, 0] * throttle.x
+            self.force[index, 1] = self.max_drone_force[index, 1] * throttle.y
+            self.force[index, 2] = self.max_drone_force[index, 2] * throttle.z
+
+
+"""
+View on a single drone of a SwarmWorld. It offers the same API as World so FlightController and DWNode can use it as
+their world reference.
+"""
+class SwarmDrone:
+    def __init__(self, swarm: SwarmWorld, index: int):
+        self.swarm = swarm
+        self.index = index
+        self.do_lg = True
+
+    def __str__(self):
+        return f"Position: {self.position}<br>Velocity: {self.velocity}<br>Acceleration: {self.acceleration}"
+
+    @property
+    def position(self):
+        return C3d(*self.swarm.position[self.index].tolist())
+
+    @position.setter
+    def position(self, value: C3d):
+        self.swarm.position[self.index] = (value.x, value.y, value.z)
+
+    @property
+    def velocity(self):
+        return C3d(*self.swarm.velocity[self.index].tolist())
+
+    @velocity.setter
+    def velocity(self, value: C3d):
+        self.swarm.velocity[self.index] = (value.x, value.y, value.z)
+
+    @property
+    def acceleration(self):
+        return C3d(*self.swarm.acceleration[self.index].tolist())
+
+    @property
+    def weight(self):
+        return float(self.swarm.weight[self.index, 0])
+
+    @property
+    def max_drone_force(self):
+        return C3d(*self.swarm.max_drone_force[self.index].tolist())
+
+    @property
+    def fps(self):
+        return self.swarm.fps
+
+    @property
+    def global_lg_disabled(self):
+        return self.swarm.global_lg_disabled
+
+    def run_simulation(self, scheduler=None):
+        self.swarm.run_simulation(scheduler)
+
+    def stop_simulation(self):
+        pass
+
+    def accelerate(self, throttle: C3d):
+        self.swarm.accelerate(self.index, throttle)
+
+
+# A drone has arrived once it is closer than ARRIVAL_TOLERANCE (meters, per axis) to its destination and slower than
+# ARRIVAL_SPEED_TOLERANCE (meters per second). A parked drone that drifts out of the tolerance flies back at full rate.
+ARRIVAL_TOLERANCE = 0.02
+ARRIVAL_SPEED_TOLERANCE = 0.002
+
+
+"""
+PID position controller of one drone. The integral is taken over time (k_i is per meter second) and only while the
+throttle is not saturated, so it does not wind up on the way to a distant destination.
+
+The PID is only stable at update_interval: the damping k_d * max_drone_force / weight * update_interval has to stay
+below 2, otherwise the velocity overshoots every update and the drone ends up in a limit cycle around the destination.
+While parked the controller runs at idle_update_interval with zero throttle and only watches the position.
+"""
 class FlightController:
     # In order to ensure a stable system choose (k_d^2)/4 > k_p
     # Other values: k_p=0.02, k_i=0.0001, k_d=-0.3    k_p=0.6, k_i=0.001, k_d=-1.5  k_p=0.5, k_i=0, k_d=-2
-    def __init__(self, world_ref: World, start_destination: C3d, k_p=10, k_i=0.01, k_d=-3, update_interval=0.1):
+    def __init__(self, world_ref: World, start_destination: C3d, k_p=10, k_i=0.01, k_d=-2, update_interval=0.1,
+                 idle_update_interval=1.0, arrival_tolerance=ARRIVAL_TOLERANCE,
+                 arrival_speed_tolerance=ARRIVAL_SPEED_TOLERANCE):
         self.world = world_ref
         self.k_p = k_p
         self.k_i = k_i
         self.k_d = k_d
         self.destination = start_destination
         self.update_interval = update_interval
+        # While parked at the destination the controller only runs at the idle rate
+        self.idle_update_interval = idle_update_interval
+        self.current_update_interval = update_interval
+        self.arrival_tolerance = arrival_tolerance
+        self.arrival_speed_tolerance = arrival_speed_tolerance
+        # Missed control updates are not worth catching up, there is no physics step in between
+        self.clock = SimulationClock(update_interval, max_catch_up_steps=1)
         self.thread = None
+        self.task = None
+        self.scheduler = None
+        self._wakeup = threading.Event()
+        # Rate change for the control thread, (interval, run_now) applied between two clock advances
+        self._pending_dt = None
+        self._pending_dt_lock = threading.Lock()
         self.arrived_at_destination = False
+        # Resolved with the destination once the drone arrived there
+        self.arrival_future = Future()
+        # Controller state, reused every update
+        self._integration = C3d(0, 0, 0)
+        self._rel_pos = C3d(0, 0, 0)
+        self._throttle = C3d(0, 0, 0)
 
     def __str__(self):
         return f"Destination: {self.destination}<br>Arrived at Destination: {self.arrived_at_destination}"
@@ -186,42 +645,299 @@ class FlightController:
         lg.debug(f"Go to new destination: {destination}")
         self.world.do_lg = True
         self.arrived_at_destination = False
+        self.arrival_future.cancel()
+        self.arrival_future = Future()
+        self._set_update_interval(self.update_interval, run_now=True)
+        return self.arrival_future
+
+    def _set_update_interval(self, interval, run_now=False):
+        if interval == self.current_update_interval and not run_now:
+            return
+        self.current_update_interval = interval
+        if self.task is not None:
+            self.scheduler.set_interval(self.task, interval, run_now)
+        else:
+            # Usually called from within clock.advance, which still has to take the old dt off the accumulator
+            with self._pending_dt_lock:
+                run_now = run_now or (self._pending_dt is not None and self._pending_dt[1])
+                self._pending_dt = (interval, run_now)
+            self._wakeup.set()
+
+    def control_step(self):
+        rel_pos = self._rel_pos.set(self.destination).isub(self.world.position)
+        if self.arrived_at_destination:
+            if rel_pos.close_to_zero(self.arrival_tolerance):
+                return
+            lg.debug(f"Drifted away from the destination, relative position: {rel_pos}")
+            self.world.do_lg = True
+            self.arrived_at_destination = False
+            self._set_update_interval(self.update_interval)
+
+        throttle = self._throttle.set(rel_pos).imul(self.k_p).iadd_scaled(self._integration, self.k_i)\
+            .iadd_scaled(self.world.velocity, self.k_d)
+        # Anti-windup, the integral only grows while the output is not saturated
+        if throttle.close_to_zero(1):
+            self._integration.iadd_scaled(rel_pos, self.current_update_interval)
+        throttle.min_max_norm(1)
+        if rel_pos.close_to_zero(self.arrival_tolerance) and \
+                self.world.velocity.close_to_zero(self.arrival_speed_tolerance):
+            # The PID is not stable at the idle rate, the drone is parked with zero throttle instead
+            throttle.imul(0)
+            self.world.do_lg = False
+            self.arrived_at_destination = True
+            self._set_update_interval(self.idle_update_interval)
+            if not self.arrival_future.done():
+                self.arrival_future.set_result(self.destination)
+        self.world.accelerate(throttle)
 
     def __control_loop(self):
-        integration = C3d(0, 0, 0)
         while True:
-            rel_pos = copy.deepcopy(self.destination) - copy.deepcopy(self.world.position)
+            self._wakeup.clear()
+            self.clock.advance(self._clocked_control_step)
+            with self._pending_dt_lock:
+                pending, self._pending_dt = self._pending_dt, None
+            if pending is not None:
+                self.clock.set_dt(pending[0], step_now=pending[1])
+            self._wakeup.wait(self.clock.time_until_next_step())
+
+    def _clocked_control_step(self, dt):
+        self.control_step()
+
+    def run_controller(self, scheduler=None):
+        if scheduler is not None:
+            self.scheduler = scheduler
+            self.task = scheduler.add_periodic("control", self.current_update_interval, self.control_step)
+            return
+        self.thread = threading.Thread(target=self.__control_loop)
 
-            integration += copy.deepcopy(rel_pos)
+        self.thread.start()
 
-            throttle = copy.deepcopy(rel_pos) * self.k_p + integration * self.k_i + copy.deepcopy(self.world.velocity) * self.k_d
-            throttle.min_max_norm(1)
-            self.world.accelerate(throttle)
-            if copy.deepcopy(rel_pos).close_to_zero(0.00001):
-                self.world.do_lg = False
-                self.arrived_at_destination = True
-            time.sleep(self.update_interval)
 
-    def run_controller(self):
-        self.thread = threading.Thread(target=self.__control_loop)
+"""
+PID controller for a whole SwarmWorld. Destinations, integrators and gains are kept as arrays and the throttle of every
+drone is computed in one vectorized update that writes the swarm force array directly. Like in the FlightController the
+integral only grows while the throttle of a drone is not saturated, and it is clamped so its share of the throttle can
+never exceed full throttle (anti-windup). Once every drone arrived the whole swarm is parked with zero throttle.
+"""
+class SwarmFlightController:
+    def __init__(self, swarm: SwarmWorld, start_destinations=None, k_p=10, k_i=0.01, k_d=-2, update_interval=0.1,
+                 arrival_tolerance=ARRIVAL_TOLERANCE, collision_avoidance=None, idle_update_interval=1.0,
+                 arrival_speed_tolerance=ARRIVAL_SPEED_TOLERANCE):
+        self.swarm = swarm
+        # Optional collision.CollisionAvoidance whose separation throttle takes precedence over the PID output
+        self.collision_avoidance = collision_avoidance
+        n = swarm.n_drones
+        self.k_p = self._per_drone(k_p)
+        self.k_i = self._per_drone(k_i)
+        self.k_d = self._per_drone(k_d)
+        if start_destinations is None:
+            self.destination = swarm.position.copy()
+        else:
+            self.destination = swarm._to_array(start_destinations)
+        self.integration = np.zeros((n, 3))
+        self._update_integration_limit()
+        self.update_interval = update_interval
+        # Once every drone is parked the controller only runs at the idle rate
+        self.idle_update_interval = idle_update_interval
+        self.current_update_interval = update_interval
+        self.arrival_tolerance = arrival_tolerance
+        self.arrival_speed_tolerance = arrival_speed_tolerance
+        self.arrived = np.zeros(n, dtype=bool)
+        self.parked = False
+        self.clock = SimulationClock(update_interval, max_catch_up_steps=1)
+        self.thread = None
+        self.task = None
+        self.scheduler = None
+        self._wakeup = threading.Event()
+        # Rate change for the control thread, (interval, run_now) applied between two clock advances
+        self._pending_dt = None
+        self._pending_dt_lock = threading.Lock()
+        # Resolved once every drone arrived at its destination
+        self.arrival_future = Future()
+
+        # Scratch buffers reused every update
+        self._rel_pos = np.zeros((n, 3))
+        self._throttle = np.zeros((n, 3))
+        self._buf = np.zeros((n, 3))
+        self._arrived_buf = np.zeros(n, dtype=bool)
+
+    def _per_drone(self, gain):
+        return np.broadcast_to(np.asarray(gain, dtype=float).reshape(-1, 1), (self.swarm.n_drones, 1)).copy()
+
+    def _update_integration_limit(self):
+        with np.errstate(divide='ignore'):
+            self.integration_limit = 1 / np.abs(self.k_i)
 
+    def __str__(self):
+        return f"Drones: {self.swarm.n_drones}<br>Arrived: {int(self.arrived.sum())}"
+
+    @property
+    def arrived_at_destination(self):
+        return bool(self.arrived.all())
+
+    def go_to_point(self, index, destination: C3d):
+        self.destination[index] = (destination.x, destination.y, destination.z)
+        self.arrived[index] = False
+        return self._new_arrival_future()
+
+    def set_destinations(self, destinations):
+        self.destination[:] = destinations
+        self.arrived[:] = False
+        return self._new_arrival_future()
+
+    def _new_arrival_future(self):
+        if self.arrival_future.done() or self.parked:
+            self.parked = False
+            self.arrival_future.cancel()
+            self.arrival_future = Future()
+            self._set_update_interval(self.update_interval, run_now=True)
+        return self.arrival_future
+
+    def _set_update_interval(self, interval, run_now=False):
+        if interval == self.current_update_interval and not run_now:
+            return
+        self.current_update_interval = interval
+        if self.task is not None:
+            self.scheduler.set_interval(self.task, interval, run_now)
+        else:
+            # Usually called from within clock.advance, which still has to take the old dt off the accumulator
+            with self._pending_dt_lock:
+                run_now = run_now or (self._pending_dt is not None and self._pending_dt[1])
+                self._pending_dt = (interval, run_now)
+            self._wakeup.set()
+
+    def set_gains(self, index, k_p=None, k_i=None, k_d=None):
+        if k_p is not None:
+            self.k_p[index] = k_p
+        if k_i is not None:
+            self.k_i[index] = k_i
+        if k_d is not None:
+            self.k_d[index] = k_d
+        self._update_integration_limit()
+
+    def _within(self, values, tolerance, out):
+        np.abs(values, out=self._buf)
+        return np.all(self._buf < tolerance, axis=1, out=out)
+
+    def control_step(self):
+        rel_pos = self._rel_pos
+        np.subtract(self.destination, self.swarm.position, out=rel_pos)
+        if self.parked:
+            if self._within(rel_pos, self.arrival_tolerance, self.arrived).all():
+                return
+            lg.debug(f"{int((~self.arrived).sum())} drones drifted away from their destination")
+            self.parked = False
+            self._set_update_interval(self.update_interval)
+
+        throttle = self._throttle
+        np.multiply(rel_pos, self.k_p, out=throttle)
+        np.multiply(self.integration, self.k_i, out=self._buf)
+        throttle += self._buf
+        np.multiply(self.swarm.velocity, self.k_d, out=self._buf)
+        throttle += self._buf
+
+        unsaturated = np.abs(throttle).max(axis=1) < 1
+        np.multiply(rel_pos, self.current_update_interval, out=self._buf)
+        self._buf *= unsaturated[:, None]
+        self.integration += self._buf
+        np.minimum(self.integration, self.integration_limit, out=self.integration)
+        np.negative(self.integration_limit, out=self._buf[:, :1])
+        np.maximum(self.integration, self._buf[:, :1], out=self.integration)
+
+        np.minimum(throttle, 1, out=throttle)
+        np.maximum(throttle, -1, out=throttle)
+        if self.collision_avoidance is not None:
+            # Separation has priority, the PID output only gets the throttle the separation leaves over
+            separation = self.collision_avoidance.separation_throttle(self.swarm.position, self.swarm.velocity)
+            share = 1 - np.minimum(np.abs(separation).max(axis=1), 1)
+            throttle *= share[:, None]
+            throttle += separation
+            np.minimum(throttle, 1, out=throttle)
+            np.maximum(throttle, -1, out=throttle)
+
+        self._within(rel_pos, self.arrival_tolerance, self.arrived)
+        self.arrived &= self._within(self.swarm.velocity, self.arrival_speed_tolerance, self._arrived_buf)
+        if self.arrived.all():
+            # The PID is not stable at the idle rate, the swarm is parked with zero throttle instead
+            throttle.fill(0)
+            self.parked = True
+            self._set_update_interval(self.idle_update_interval)
+            if not self.arrival_future.done():
+                self.arrival_future.set_result(self.destination.copy())
+
+        with self.swarm.force_lock:
+            np.multiply(self.swarm.max_drone_force, throttle, out=self.swarm.force)
+
+    def __control_loop(self):
+        while True:
+            self._wakeup.clear()
+            self.clock.advance(self._clocked_control_step)
+            with self._pending_dt_lock:
+                pending, self._pending_dt = self._pending_dt, None
+            if pending is not None:
+                self.clock.set_dt(pending[0], step_now=pending[1])
+            self._wakeup.wait(self.clock.time_until_next_step())
+
+    def _clocked_control_step(self, dt):
+        self.control_step()
+
+    def run_controller(self, scheduler=None):
+        if scheduler is not None:
+            self.scheduler = scheduler
+            self.task = scheduler.add_periodic("control", self.current_update_interval, self.control_step)
+            return
+        self.thread = threading.Thread(target=self.__control_loop, daemon=True)
         self.thread.start()
 
 
+"""
+Steps worlds and flight controllers in simulated time as fast as the CPU allows, without any threads. Used for offline
+runs of formation scenarios. Pass a SwarmWorld itself, not its drone views, so the swarm is stepped once per tick.
+"""
+class HeadlessSimulation:
+    def __init__(self, worlds, controllers=(), dt=None):
+        self.worlds = list(worlds)
+        self.controllers = list(controllers)
+        self.dt = dt if dt is not None else 1/max(w.fps for w in self.worlds)
+        self.sim_time = 0.0
+        self.steps = 0
+        self._last_control_time = [None] * len(self.controllers)
+
+    def step(self):
+        for i, fc in enumerate(self.controllers):
+            # The controllers may change their rate (idle while parked), so the next update follows the current one
+            last = self._last_control_time[i]
+            if last is None or last + fc.current_update_interval <= self.sim_time + self.dt / 2:
+                fc.control_step()
+                self._last_control_time[i] = self.sim_time
+        for world in self.worlds:
+            world.step(self.dt)
+        self.sim_time += self.dt
+        self.steps += 1
+
+    def all_arrived(self):
+        return all(fc.arrived_at_destination for fc in self.controllers)
+
+    def run(self, duration_s, until=None):
+        end_time = self.sim_time + duration_s
+        while self.sim_time < end_time:
+            self.step()
+            if until is not None and until():
+                break
+        return self.sim_time
+
+
 if __name__ == '__main__':
     world = World(max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2, start_position=C3d(0, 0, 0))
     fc = FlightController(world_ref=world, start_destination=C3d(0, 0, 0))
     world.run_simulation()
     fc.run_controller()
-    time.sleep(1)
-
+    arrival = fc.arrival_future
 
     while True:
-        if fc.arrived_at_destination:
-            x = input("X:")
-            y = input("Y:")
-            z = input("Z:")
-            fc.go_to_point(C3d(float(x), float(y), float(z)))
-            lg.info(f"Command new destination at: x:{x} | y:{y} | z:{z}")
-        else:
-            time.sleep(1)
+        arrival.result()
+        x = input("X:")
+        y = input("Y:")
+        z = input("Z:")
+        arrival = fc.go_to_point(C3d(float(x), float(y), float(z)))
+        lg.info(f"Command new destination at: x:{x} | y:{y} | z:{z}")
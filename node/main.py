@@ -61,7 +61,7 @@ def index_get():
                 buf = ""
                 for k, v in sorted(val.items(), key=lambda item: item[1]['peer'].ip):
                     peer = v['peer']
-                    last_alive_sec_ago = time.time() - peer.last_alive
+                    last_alive_sec_ago = peer.clock() - peer.last_alive
                     offline = not peer.is_online()
                     isleader = node.middleware.is_uid_leader(peer.uid)
                     textcolor = 'grey'
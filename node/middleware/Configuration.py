@@ -1,5 +1,27 @@
 from MiddelwareEvents import MiddlewareEvents
 encoding = 'utf-8'
+# 'binary' for the compact wire format, 'json' sends human readable datagrams for debugging
+WIRE_FORMAT = 'binary'
+# Messages to the same destination sent within this window are coalesced into one datagram, 0 sends immediately
+BATCH_FLUSH_WINDOW_S = 0.002
+# Payload budget of a coalesced datagram, stays below the Ethernet MTU minus IP and UDP headers
+MAX_DATAGRAM_BYTES = 1400
+# How often the own IP address is resolved again to notice interface changes
+IP_REFRESH_INTERVAL_S = 10
+# Largest datagram that can be received
+MAX_RECEIVE_BYTES = 10240
+# Messages larger than MAX_DATAGRAM_BYTES are sent in fragments, up to this size
+MAX_MESSAGE_BYTES = 1024 * 1024
+# Partially received fragmented messages are dropped after this time or when the buffer limits are exceeded
+REASSEMBLY_TIMEOUT_S = 2.0
+REASSEMBLY_MAX_PENDING = 256
+REASSEMBLY_MAX_BYTES = 8 * 1024 * 1024
+# Receive buffers for datagrams waiting for the middleware callbacks, further datagrams are dropped while all are in use
+RECEIVE_BUFFER_SLOTS = 1024
+# Datagrams read from one socket per wakeup of the receive loop, the loop calls back while more are queued
+RECEIVE_DRAIN_BUDGET = 64
+# Kernel receive buffer per socket (SO_RCVBUF), absorbs heartbeat bursts of large swarms. 0 keeps the OS default
+RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
 
 MCAST_GRP = '224.1.1.1'
 
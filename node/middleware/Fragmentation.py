@@ -0,0 +1,187 @@
+import collections
+import os
+import struct
+import threading
+import time
+
+from Configuration import MAX_MESSAGE_BYTES, REASSEMBLY_TIMEOUT_S, REASSEMBLY_MAX_PENDING, REASSEMBLY_MAX_BYTES
+from Logger import lg
+
+"""
+Fragmentation of encoded messages that do not fit into one datagram.
+
+Every fragment is a datagram of its own:
+
+    magic (B) | version (B) | stream (I) | message id (I) | index (H) | count (H) | payload
+
+stream is chosen at random per sender, message id counts the fragmented messages of that sender. Together they identify
+the message on the receiving side without knowing where the datagram came from. Fragments start with FRAGMENT_MAGIC, so
+receivers tell them apart from single messages and batches by the first byte.
+"""
+FRAGMENT_MAGIC = 0xD9
+FRAGMENT_VERSION = 1
+
+_FRAGMENT_HEADER = struct.Struct('!BBIIHH')
+_MAX_FRAGMENTS = 0xFFFF
+
+
+class FragmentationError(ValueError):
+    pass
+
+
+def is_fragment(data):
+    return data[:1] == bytes((FRAGMENT_MAGIC,))
+
+
+"""
+Splits encoded messages into fragments of at most max_datagram_bytes each.
+"""
+class Fragmenter:
+    def __init__(self, max_datagram_bytes, max_message_bytes=MAX_MESSAGE_BYTES):
+        if max_datagram_bytes <= _FRAGMENT_HEADER.size:
+            raise ValueError(f"Datagrams of {max_datagram_bytes} bytes cannot hold a fragment")
+        self.payload_bytes = max_datagram_bytes - _FRAGMENT_HEADER.size
+        self.max_message_bytes = max_message_bytes
+        self.stream = struct.unpack('!I', os.urandom(4))[0]
+        self._next_message_id = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.messages_fragmented = 0
+        self.fragments_sent = 0
+
+    def __str__(self):
+        return f"Fragmented: {self.messages_fragmented} messages in {self.fragments_sent} fragments"
+
+    def split(self, data):
+        count = -(-len(data) // self.payload_bytes)
+        if len(data) > self.max_message_bytes or count > _MAX_FRAGMENTS:
+            raise FragmentationError(f"Message of {len(data)} bytes exceeds the limit of {self.max_message_bytes}")
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id = (message_id + 1) & 0xFFFFFFFF
+            self.messages_fragmented += 1
+            self.fragments_sent += count
+
+        view = memoryview(data)
+        return [_FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, self.stream, message_id, index, count)
+                + view[index * self.payload_bytes:(index + 1) * self.payload_bytes]
+                for index in range(count)]
+
+
+class _PartialMessage:
+    __slots__ = ('parts', 'missing', 'size', 'started')
+
+    def __init__(self, count, started):
+        self.parts = [None] * count
+        self.missing = count
+        self.size = 0
+        self.started = started
+
+
+"""
+Collects fragments until their message is complete. The buffer is bounded: partial messages older than timeout_s are
+dropped, and when more than max_pending messages or max_bytes of fragments are buffered the oldest partial message is
+evicted. Both count as lost messages. Not thread safe, the receiver feeds it from its dispatch thread only. clock is
+the time source of the timeout when add and expire are called without now.
+"""
+class Reassembler:
+    def __init__(self, timeout_s=REASSEMBLY_TIMEOUT_S, max_pending=REASSEMBLY_MAX_PENDING,
+                 max_bytes=REASSEMBLY_MAX_BYTES, max_message_bytes=MAX_MESSAGE_BYTES, clock=time.monotonic):
+        self.timeout_s = timeout_s
+        self.clock = clock
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.max_message_bytes = max_message_bytes
+        # Insertion ordered, the oldest partial message comes first
+        self.pending = collections.OrderedDict()
+        self.buffered_bytes = 0
+
+        # Metrics
+        self.fragments_received = 0
+        self.duplicate_fragments = 0
+        self.invalid_fragments = 0
+        self.messages_reassembled = 0
+        self.messages_expired = 0
+        self.messages_evicted = 0
+
+    def __str__(self):
+        return f"Reassembled: {self.messages_reassembled} | " \
+               f"Pending: {len(self.pending)} ({self.buffered_bytes} bytes) | " \
+               f"Lost: {self.messages_lost} (expired {self.messages_expired}, evicted {self.messages_evicted}) | " \
+               f"Fragments: {self.fragments_received} (duplicate {self.duplicate_fragments}, " \
+               f"invalid {self.invalid_fragments})"
+
+    @property
+    def messages_lost(self):
+        return self.messages_expired + self.messages_evicted
+
+    def _drop_oldest(self):
+        _, partial = self.pending.popitem(last=False)
+        self.buffered_bytes -= partial.size
+
+    def expire(self, now=None):
+        now = self.clock() if now is None else now
+        while self.pending:
+            partial = next(iter(self.pending.values()))
+            if now - partial.started < self.timeout_s:
+                break
+            self._drop_oldest()
+            self.messages_expired += 1
+            lg.debug(f"Fragmented message expired after {self.timeout_s}s, lost {self.messages_lost} so far")
+
+    """
+    Adds one fragment. Returns the complete encoded message once its last fragment arrived, None otherwise. The payload
+    is copied, data can be a view into a buffer that is reused afterwards.
+    """
+    def add(self, data, now=None):
+        now = self.clock() if now is None else now
+        self.fragments_received += 1
+        self.expire(now)
+        if len(data) < _FRAGMENT_HEADER.size:
+            self.invalid_fragments += 1
+            return None
+        _, version, stream, message_id, index, count = _FRAGMENT_HEADER.unpack_from(data)
+        if version != FRAGMENT_VERSION or index >= count:
+            self.invalid_fragments += 1
+            return None
+        payload = bytes(data[_FRAGMENT_HEADER.size:])
+        if count == 1:
+            self.messages_reassembled += 1
+            return payload
+
+        key = (stream, message_id)
+        partial = self.pending.get(key)
+        if partial is None:
+            partial = _PartialMessage(count, now)
+            self.pending[key] = partial
+        elif len(partial.parts) != count:
+            self.invalid_fragments += 1
+            return None
+        if partial.parts[index] is not None:
+            self.duplicate_fragments += 1
+            return None
+
+        partial.parts[index] = payload
+        partial.missing -= 1
+        partial.size += len(payload)
+        self.buffered_bytes += len(payload)
+        if partial.size > self.max_message_bytes:
+            del self.pending[key]
+            self.buffered_bytes -= partial.size
+            self.invalid_fragments += 1
+            lg.warning(f"Dropping fragmented message exceeding {self.max_message_bytes} bytes")
+            return None
+        if partial.missing == 0:
+            del self.pending[key]
+            self.buffered_bytes -= partial.size
+            self.messages_reassembled += 1
+            return b''.join(partial.parts)
+
+        while len(self.pending) > self.max_pending or self.buffered_bytes > self.max_bytes:
+            self._drop_oldest()
+            self.messages_evicted += 1
+            lg.warning(f"Reassembly buffer full, evicted a partial message, lost {self.messages_lost} so far")
+            if key not in self.pending:
+                break
+        return None
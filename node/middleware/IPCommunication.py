@@ -1,25 +1,45 @@
+import asyncio
+import collections
+import queue
 import socket
+import sys
 import threading
 import struct
-import json
 import time
 
-from Configuration import encoding
 from Messaging import Message, DefaultHeaders, DefaultMessageTypes
+from WireFormat import encode_message, decode_datagram, encode_batch, batch_size, WireFormatError
+from Fragmentation import Fragmenter, Reassembler, FragmentationError, is_fragment
+from Configuration import BATCH_FLUSH_WINDOW_S, MAX_DATAGRAM_BYTES, MAX_RECEIVE_BYTES, RECEIVE_BUFFER_SLOTS, \
+    RECEIVE_BUFFER_BYTES, RECEIVE_DRAIN_BUDGET
 from Utils import getCurrentIpAddress
 from Logger import lg
 
 
 
+"""
+Sends messages by multicast or unicast. With a flush window, messages are queued per destination and everything queued
+within the window is sent as one datagram (split when max_datagram_bytes would be exceeded). The flush runs on the
+scheduler if one is given, otherwise on a timer thread. A message that does not fit into one datagram on its own is sent
+right away in fragments, after whatever was queued for the same destination.
+
+Datagrams leave through two channels, anything with a socket-like sendto(data, address). By default these are UDP
+sockets, an in-memory transport passes its own channels and a fixed origin_ip.
+"""
 class IPSender:
-    def __init__(self, multicast_addr, mcast_port, uncast_port, additional_default_headers, uid):
+    def __init__(self, multicast_addr, mcast_port, uncast_port, additional_default_headers, uid,
+                 flush_window_s=BATCH_FLUSH_WINDOW_S, max_datagram_bytes=MAX_DATAGRAM_BYTES, scheduler=None,
+                 channels=None, origin_ip=None):
         self.multicast_addr = multicast_addr
         self.mcast_port = mcast_port
         self.uncast_port = uncast_port
-        self.mcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self.mcast_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        if channels is None:
+            self.mcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            self.mcast_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
 
-        self.uncast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.uncast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.mcast_sock, self.uncast_sock = channels
 
         self.leave_out_intervall = 5
         self.leave_out_counter = 0
@@ -30,9 +50,52 @@ class IPSender:
             self.additional_default_headers = additional_default_headers
         self.uid = uid
 
+        # The header fields that are the same for every message are built once, see refresh_address
+        self.fixed_origin_ip = origin_ip is not None
+        self.origin_ip = origin_ip if self.fixed_origin_ip else getCurrentIpAddress()
+        self._build_default_headers()
+
+        # Coalescing
+        self.flush_window_s = flush_window_s
+        self.max_datagram_bytes = max_datagram_bytes
+        self.scheduler = scheduler
+        self._pending = dict()
+        self._pending_lock = threading.Lock()
+        self._flush_scheduled = False
+        self.fragmenter = Fragmenter(max_datagram_bytes)
+        self.messages_sent = 0
+        self.datagrams_sent = 0
+
+    def __str__(self):
+        return f"Sent: {self.messages_sent} messages in {self.datagrams_sent} datagrams | {self.fragmenter}"
+
+    def _build_default_headers(self):
+        self._static_header = self.additional_default_headers | {DefaultHeaders.ORIGIN_IP: self.origin_ip,
+                                                                 DefaultHeaders.UNICAST_PORT: self.uncast_port,
+                                                                 DefaultHeaders.UID: self.uid}
+        # One complete default header per destination, callers merge into a new dict and never modify these
+        self._default_headers = dict()
+
     def _generate_default_header(self, destination_ip):
-        return self.additional_default_headers | {DefaultHeaders.ORIGIN_IP: getCurrentIpAddress(), DefaultHeaders.UNICAST_PORT: self.uncast_port , DefaultHeaders.DESTINATION_IP: destination_ip,
-                                                  DefaultHeaders.UID: self.uid}
+        header = self._default_headers.get(destination_ip)
+        if header is None:
+            header = self._static_header | {DefaultHeaders.DESTINATION_IP: destination_ip}
+            self._default_headers[destination_ip] = header
+        return header
+
+    """
+    Resolves the own address again and rebuilds the default headers if it changed. Returns whether it changed.
+    """
+    def refresh_address(self):
+        if self.fixed_origin_ip:
+            return False
+        ip = getCurrentIpAddress(refresh=True)
+        if ip == self.origin_ip:
+            return False
+        lg.info(f"Own IP address changed from {self.origin_ip} to {ip}.")
+        self.origin_ip = ip
+        self._build_default_headers()
+        return True
 
     def send_message_multicast(self, message: Message):
         #if self.leave_out_intervall <= self.leave_out_counter:
@@ -45,12 +108,8 @@ class IPSender:
             message.header = {}
 
         message.header = message.header | self._generate_default_header(self.multicast_addr)
-        msg_str = json.dumps(message.__dict__)
-        try:
-            self.mcast_sock.sendto(msg_str.encode(), (self.multicast_addr, self.mcast_port))
-        except OSError as e:
-            lg.error(f"Error sending multicast Message: {e}")
-        lg.debug(f"Message send mc: {msg_str}")
+        self._send(self.mcast_sock, (self.multicast_addr, self.mcast_port), encode_message(message))
+        lg.debug(f"Message send mc: {message.header}")
 
 
     def send_message_unicast(self, destination_ip, destination_port,message_body, custom_headers):
@@ -58,19 +117,134 @@ class IPSender:
             custom_headers = {}
 
         msg = Message(self._generate_default_header(destination_ip) | custom_headers, message_body)
-        msg_str = json.dumps(msg.__dict__)
+        self._send(self.uncast_sock, (destination_ip, destination_port), encode_message(msg))
+        lg.debug(f"Message send uc: {msg.header}")
+
+    def _send(self, sock, address, data):
+        self.messages_sent += 1
+        if len(data) > self.max_datagram_bytes:
+            self._send_fragmented(sock, address, data)
+            return
+        if self.flush_window_s <= 0:
+            self._transmit(sock, address, [data])
+            return
+
+        full_batch = None
+        with self._pending_lock:
+            queued = self._pending.setdefault((sock, address), [])
+            if queued and batch_size(queued + [data]) > self.max_datagram_bytes:
+                # No room left, send what is queued now and start a new batch
+                full_batch = list(queued)
+                queued.clear()
+            queued.append(data)
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+
+        if full_batch:
+            self._transmit(sock, address, full_batch)
+        if schedule:
+            if self.scheduler is not None:
+                self.scheduler.call_later(self.flush_window_s, self.flush, name="ip_flush")
+            else:
+                timer = threading.Timer(self.flush_window_s, self.flush)
+                timer.daemon = True
+                timer.start()
+
+    def _send_fragmented(self, sock, address, data):
         try:
-            self.uncast_sock.sendto(msg_str.encode(), (destination_ip, destination_port))
+            fragments = self.fragmenter.split(data)
+        except FragmentationError as e:
+            lg.error(f"Cannot send message to {address}: {e}")
+            return
+        with self._pending_lock:
+            queued = self._pending.pop((sock, address), None)
+        if queued:
+            self._transmit(sock, address, queued)
+        for fragment in fragments:
+            self._transmit(sock, address, [fragment])
+
+    def flush(self):
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = dict()
+            self._flush_scheduled = False
+        for (sock, address), queued in pending.items():
+            if queued:
+                self._transmit(sock, address, queued)
+
+    def _transmit(self, sock, address, encoded_messages):
+        data = encoded_messages[0] if len(encoded_messages) == 1 else encode_batch(encoded_messages)
+        try:
+            sock.sendto(data, address)
+            self.datagrams_sent += 1
         except OSError as e:
-            lg.error(f"Error sending unicast Message: {e}")
-        lg.debug(f"Message send uc: {msg_str}")
+            lg.error(f"Error sending Message to {address}: {e}")
 
 
 """
-This Class wraps some basic Receive Functionalities around the basic OS-Socket Library
+Decoding and delivery shared by the receivers: reassembles fragments, decodes single messages and batches and calls
+cb_mc or cb_uncast for every message. A failing callback is logged and does not affect the other messages.
 """
-class IPReceiver:
-        def __init__(self, Multicast_Address, Multicast_Port, unicast_address, unicast_port, cb_mc, cb_uncast):
+class DatagramReceiver:
+    MULTICAST = 'multicast'
+    UNICAST = 'unicast'
+
+    def __init__(self, cb_mc, cb_uncast, clock=time.monotonic):
+        self.callbacks = {self.MULTICAST: cb_mc, self.UNICAST: cb_uncast}
+        self.reassembler = Reassembler(clock=clock)
+        self.datagrams_received = 0
+
+    def _decode(self, data):
+        # Returns the messages of the datagram, an empty list while a fragmented message is incomplete
+        try:
+            if is_fragment(data):
+                data = self.reassembler.add(data)
+                if data is None:
+                    return []
+            return decode_datagram(data)
+        except WireFormatError as e:
+            lg.warning(f"Dropping datagram: {e}")
+            return []
+        except Exception as e:
+            lg.error(f"Decoding a datagram failed, dropping it: {e}")
+            return []
+
+    def _dispatch(self, kind, messages):
+        cb = self.callbacks[kind]
+        for message in messages:
+            try:
+                cb(message)
+            except Exception as e:
+                lg.error(f"Receive callback for {kind} message failed: {e}")
+
+    def deliver(self, kind, data):
+        self._dispatch(kind, self._decode(data))
+
+    def shutdownReceiver(self, timeout_s=1.0):
+        pass
+
+
+# Kernel counter of datagrams dropped because the socket receive buffer was full (Linux only)
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+
+
+"""
+Receives multicast and unicast datagrams on an asyncio event loop running in its own thread. When a socket becomes
+readable, up to drain_budget pending datagrams are read with recv_into into a slot of a preallocated buffer pool and the whole batch
+is handed to the dispatch thread, which decodes it in place and calls cb_mc / cb_uncast in arrival order. A slow
+callback therefore does not stop the sockets from being read, and the budget keeps a busy multicast socket from starving
+the unicast socket. If all buffer slots are in use, further datagrams are read into a scratch buffer and dropped.
+
+Drops are counted: dropped_datagrams for a full buffer pool, kernel_dropped_datagrams for datagrams the kernel discarded
+because the socket receive buffer (SO_RCVBUF, receive_buffer_bytes) overflowed. Fragments are collected by the
+reassembler, which also counts the fragmented messages that were lost.
+"""
+class IPReceiver(DatagramReceiver):
+        def __init__(self, Multicast_Address, Multicast_Port, unicast_address, unicast_port, cb_mc, cb_uncast,
+                     buffer_slots=RECEIVE_BUFFER_SLOTS, receive_buffer_bytes=RECEIVE_BUFFER_BYTES,
+                     drain_budget=RECEIVE_DRAIN_BUDGET):
+            super().__init__(cb_mc, cb_uncast)
+            self.drain_budget = drain_budget
             self.MCAST_ADDR = Multicast_Address
             self.MCAST_PORT = Multicast_Port
             self.UNCAST_ADDR = unicast_address
@@ -88,29 +262,134 @@ class IPReceiver:
             self.uncast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.uncast_sock.bind((self.UNCAST_ADDR, self.UNCAST_PORT))
 
-            # Start Threads
-            mcast_thread = threading.Thread(target=self._t_run_mcast_receiver_loop, args=(cb_mc,), kwargs={})
-            mcast_thread.start()
-            uncast_thread = threading.Thread(target=self._t_run_uncast_receiver_loop, args=(cb_uncast,), kwargs={})
-            uncast_thread.start()
+            self.sockets = {self.MULTICAST: self.mcast_sock, self.UNICAST: self.uncast_sock}
+            self.kernel_drops = {self.MULTICAST: 0, self.UNICAST: 0}
+            self._ancillary_size = 0
+            for sock in self.sockets.values():
+                self._configure_socket(sock, receive_buffer_bytes)
+
+            # Buffer pool, slots are handed to the dispatch thread and given back once decoded
+            self.slots = [memoryview(bytearray(MAX_RECEIVE_BYTES)) for _ in range(buffer_slots)]
+            self._free_slots = collections.deque(range(buffer_slots))
+            self._scratch = memoryview(bytearray(MAX_RECEIVE_BYTES))
+            self.queue = queue.SimpleQueue()
+            self.dropped_datagrams = 0
+
+            # Start event loop and dispatcher. The selector loop supports add_reader on every platform.
+            self.loop = asyncio.SelectorEventLoop()
+            self.loop_thread = threading.Thread(target=self._t_run_event_loop, name="ip-receiver", daemon=True)
+            self.loop_thread.start()
+            self.dispatch_thread = threading.Thread(target=self._t_dispatch, name="ip-dispatch", daemon=True)
+            self.dispatch_thread.start()
 
             lg.debug("Reactor Running")
 
-        def _t_run_mcast_receiver_loop(self, cb):
-            while (not self.stopReceiving):
-                msg_received = self.mcast_sock.recv(10240)
-                msg_received = str(msg_received, encoding)
-                msg_received = json.loads(msg_received)
-                msg_received = Message(**msg_received)
-                cb(msg_received)
-
-        def _t_run_uncast_receiver_loop(self, cb):
-            while (not self.stopReceiving):
-                msg_received = self.uncast_sock.recv(10240)
-                msg_received = str(msg_received, encoding)
-                msg_received = json.loads(msg_received)
-                msg_received = Message(**msg_received)
-                cb(msg_received)
-
-        def shutdownReceiver(self):
-            self.stopReceiving = True
\ No newline at end of file
+        def __str__(self):
+            return f"Received: {self.datagrams_received} | Dropped (pool): {self.dropped_datagrams} | " \
+                   f"Dropped (kernel): {self.kernel_dropped_datagrams} | Free slots: {len(self._free_slots)} | " \
+                   f"{self.reassembler}"
+
+        @property
+        def kernel_dropped_datagrams(self):
+            return sum(self.kernel_drops.values())
+
+        def _configure_socket(self, sock, receive_buffer_bytes):
+            sock.setblocking(False)
+            if receive_buffer_bytes:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_bytes)
+                # Linux reports twice the usable size and caps the request at net.core.rmem_max
+                actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+                if actual < receive_buffer_bytes:
+                    lg.warning(f"Socket receive buffer is {actual} bytes instead of {receive_buffer_bytes}, "
+                               f"raise net.core.rmem_max to allow more")
+            if SO_RXQ_OVFL is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                    self._ancillary_size = socket.CMSG_SPACE(4)
+                except OSError:
+                    pass
+
+        def _t_run_event_loop(self):
+            asyncio.set_event_loop(self.loop)
+            for kind, sock in self.sockets.items():
+                self.loop.add_reader(sock, self._drain, kind, sock)
+            self.loop.run_forever()
+
+            # Stopped by shutdownReceiver
+            for sock in self.sockets.values():
+                self.loop.remove_reader(sock)
+                sock.close()
+            self.loop.close()
+
+        def _receive_into(self, kind, sock, view):
+            if not self._ancillary_size:
+                return sock.recv_into(view)
+            nbytes, ancdata, _, _ = sock.recvmsg_into([view], self._ancillary_size)
+            for level, cmsg_type, data in ancdata:
+                if level == socket.SOL_SOCKET and cmsg_type == SO_RXQ_OVFL and len(data) >= 4:
+                    # Running total of the socket
+                    self.kernel_drops[kind] = struct.unpack('=I', data[:4])[0]
+            return nbytes
+
+        def _drain(self, kind, sock):
+            # Called by the event loop when the socket is readable. Reads until the kernel queue is empty or the budget is
+            # used up, the selector is level triggered and calls again for the rest after the other ready callbacks.
+            batch = []
+            for _ in range(self.drain_budget):
+                slot = self._free_slots.popleft() if self._free_slots else None
+                view = self._scratch if slot is None else self.slots[slot]
+                try:
+                    nbytes = self._receive_into(kind, sock, view)
+                except (BlockingIOError, InterruptedError):
+                    if slot is not None:
+                        self._free_slots.appendleft(slot)
+                    break
+                except OSError as e:
+                    if slot is not None:
+                        self._free_slots.appendleft(slot)
+                    lg.warning(f"Error on {kind} socket: {e}")
+                    break
+                self.datagrams_received += 1
+                if slot is None:
+                    self.dropped_datagrams += 1
+                    if self.dropped_datagrams % 100 == 1:
+                        lg.warning(f"Receive buffer pool exhausted, dropped {self.dropped_datagrams} datagrams so far")
+                    continue
+                batch.append((slot, nbytes))
+            if batch:
+                self.queue.put((kind, batch))
+
+        def _t_dispatch(self):
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                kind, batch = item
+                # A failing datagram is logged and dropped, it must not end the only dispatch thread
+                for slot, nbytes in batch:
+                    try:
+                        # Decoded straight from the pool buffer, the messages do not reference it afterwards
+                        messages = self._decode(self.slots[slot][:nbytes])
+                    except Exception as e:
+                        lg.error(f"Decoding a {kind} datagram failed, dropping it: {e}")
+                        messages = []
+                    finally:
+                        self._free_slots.append(slot)
+                    try:
+                        self._dispatch(kind, messages)
+                    except Exception as e:
+                        lg.error(f"Dispatching a {kind} datagram failed: {e}")
+
+        """
+        Stops receiving and closes the sockets. Datagrams already read are still delivered before the dispatch thread
+        ends.
+        """
+        def shutdownReceiver(self, timeout_s=1.0):
+            if self.stopReceiving:
+                return
+            self.stopReceiving = True
+            if not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join(timeout_s)
+            self.queue.put(None)
+            self.dispatch_thread.join(timeout_s)
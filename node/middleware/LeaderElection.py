@@ -36,6 +36,7 @@ class LeaderSubsystem:
         self.cb_leader_found = cb_leader_found
         self.received_leader_answer_message = False
         self.leader_election_necessary = False
+        self.election_in_progress = False
         self.event_engine = event_engine
 
     def participating_in_election(self):
@@ -88,17 +89,35 @@ class LeaderSubsystem:
             self.leader_election_necessary = True
 
     """
-    This thread is started if no leader is known.
+    First half of an election: ask every node that would win against this one.
     """
-    def leader_election_alg(self):
+    def start_election(self):
+        self.election_in_progress = True
         self.leader_election_necessary = False
         self.received_leader_answer_message = False
         self._broadcast_election_message()
-        time.sleep(self.VOTING_TIMEOUT)
+
+    """
+    Second half of an election, called after VOTING_TIMEOUT. Returns True if this node became the leader.
+    """
+    def finish_election(self):
         if self.received_leader_answer_message:
             lg.info("Election completed as slave.")
+            return False
+        lg.info("Election completed as leader.")
+        self.r_mcast.send(Message({DefaultHeaders.TYPE: DefaultMessageTypes.LEADER_COORDINATOR_MESSAGE}, None))
+        self.event_engine.emit_event(MiddlewareEvents.SELF_ELECTED_AS_LEADER)
+        return True
+
+    def end_election(self):
+        self.election_in_progress = False
+
+    """
+    This thread is started if no leader is known.
+    """
+    def leader_election_alg(self):
+        self.start_election()
+        time.sleep(self.VOTING_TIMEOUT)
+        if not self.finish_election():
             time.sleep(self.VOTING_TIMEOUT)
-        else:
-            lg.info("Election completed as leader.")
-            self.r_mcast.send(Message({DefaultHeaders.TYPE: DefaultMessageTypes.LEADER_COORDINATOR_MESSAGE}, None))
-            self.event_engine.emit_event(MiddlewareEvents.SELF_ELECTED_AS_LEADER)
+        self.end_election()
@@ -0,0 +1,146 @@
+import collections
+import ipaddress
+import random
+
+from Configuration import MAX_RECEIVE_BYTES
+from IPCommunication import IPSender, DatagramReceiver
+from Transport import Transport
+
+"""
+In-memory datagram network for running many nodes in one process. Datagrams are delivered as scheduler tasks of the
+shared TickScheduler, so every node, the network and the physics run on one loop and no sockets or threads are needed.
+
+The network can misbehave like a real one: every delivery is lost with probability loss, delayed by delay_s plus a
+uniform jitter of up to jitter_s, and held back for another reorder_delay_s with probability reorder so that later
+datagrams overtake it. Multicast reaches every member of the group including the sender, like IP_MULTICAST_LOOP.
+"""
+class LoopbackNetwork:
+    def __init__(self, scheduler, loss=0.0, delay_s=0.0, jitter_s=0.0, reorder=0.0, reorder_delay_s=0.005, seed=None,
+                 max_datagram_bytes=MAX_RECEIVE_BYTES, subnet='10.0.0.0/8'):
+        self.scheduler = scheduler
+        self.loss = loss
+        self.delay_s = delay_s
+        self.jitter_s = jitter_s
+        self.reorder = reorder
+        self.reorder_delay_s = reorder_delay_s
+        self.max_datagram_bytes = max_datagram_bytes
+        self.random = random.Random(seed)
+        self._hosts = ipaddress.ip_network(subnet).hosts()
+
+        self.groups = collections.defaultdict(list)
+        self.endpoints = dict()
+
+        # Accounting
+        self.datagrams_sent = 0
+        self.datagrams_delivered = 0
+        self.datagrams_lost = 0
+        self.datagrams_reordered = 0
+        self.datagrams_oversized = 0
+        self.datagrams_undeliverable = 0
+
+    def __str__(self):
+        return f"Sent: {self.datagrams_sent} | Delivered: {self.datagrams_delivered} | Lost: {self.datagrams_lost} | " \
+               f"Reordered: {self.datagrams_reordered} | Oversized: {self.datagrams_oversized} | " \
+               f"Undeliverable: {self.datagrams_undeliverable}"
+
+    def allocate_ip(self):
+        return str(next(self._hosts))
+
+    def join(self, group, receiver):
+        self.groups[group].append(receiver)
+
+    def leave(self, group, receiver):
+        if receiver in self.groups.get(group, ()):
+            self.groups[group].remove(receiver)
+
+    def bind(self, address, receiver):
+        if address in self.endpoints:
+            raise OSError(f"Address {address} already in use")
+        self.endpoints[address] = receiver
+
+    def unbind(self, address):
+        self.endpoints.pop(address, None)
+
+    # Same signature as socket.sendto, the network is the channel of every LoopbackTransport sender
+    def sendto(self, data, address):
+        self.datagrams_sent += 1
+        if len(data) > self.max_datagram_bytes:
+            self.datagrams_oversized += 1
+            return len(data)
+        if address in self.groups:
+            kind, receivers = DatagramReceiver.MULTICAST, list(self.groups[address])
+        elif address in self.endpoints:
+            kind, receivers = DatagramReceiver.UNICAST, [self.endpoints[address]]
+        else:
+            self.datagrams_undeliverable += 1
+            return len(data)
+
+        # Receivers with the same delay are served by one scheduler task
+        data = bytes(data)
+        if not (self.loss or self.jitter_s or self.reorder):
+            self.scheduler.call_later(self.delay_s, lambda: self._deliver(kind, data, receivers), name="loopback")
+            return len(data)
+        deliveries = collections.defaultdict(list)
+        for receiver in receivers:
+            if self.loss and self.random.random() < self.loss:
+                self.datagrams_lost += 1
+                continue
+            delay = self.delay_s
+            if self.jitter_s:
+                delay += self.random.random() * self.jitter_s
+            if self.reorder and self.random.random() < self.reorder:
+                delay += self.reorder_delay_s
+                self.datagrams_reordered += 1
+            deliveries[delay].append(receiver)
+        for delay, batch in deliveries.items():
+            self.scheduler.call_later(delay, lambda batch=batch: self._deliver(kind, data, batch), name="loopback")
+        return len(data)
+
+    def _deliver(self, kind, data, receivers):
+        for receiver in receivers:
+            self.datagrams_delivered += 1
+            receiver.deliver(kind, data)
+
+
+class LoopbackReceiver(DatagramReceiver):
+    def __init__(self, network: LoopbackNetwork, multicast_addr, mcast_port, ip, uncast_port, cb_mc, cb_uncast):
+        super().__init__(cb_mc, cb_uncast, clock=network.scheduler.clock)
+        self.network = network
+        self.group = (multicast_addr, mcast_port)
+        self.address = (ip, uncast_port)
+        self.stopReceiving = False
+        network.bind(self.address, self)
+        network.join(self.group, self)
+
+    def __str__(self):
+        return f"Received: {self.datagrams_received} | {self.reassembler}"
+
+    def deliver(self, kind, data):
+        if self.stopReceiving:
+            return
+        self.datagrams_received += 1
+        super().deliver(kind, data)
+
+    def shutdownReceiver(self, timeout_s=1.0):
+        if self.stopReceiving:
+            return
+        self.stopReceiving = True
+        self.network.leave(self.group, self)
+        self.network.unbind(self.address)
+
+
+"""
+Transport of one node on a LoopbackNetwork. Without an ip the node gets the next free address of the network's subnet.
+"""
+class LoopbackTransport(Transport):
+    def __init__(self, network: LoopbackNetwork, ip=None):
+        super().__init__(ip if ip is not None else network.allocate_ip())
+        self.network = network
+
+    def create_sender(self, multicast_addr, mcast_port, uncast_port, uid, scheduler=None):
+        return IPSender(multicast_addr, mcast_port, uncast_port, None, uid,
+                        scheduler=scheduler if scheduler is not None else self.network.scheduler,
+                        channels=(self.network, self.network), origin_ip=self.ip)
+
+    def create_receiver(self, multicast_addr, mcast_port, uncast_port, cb_mc, cb_uncast):
+        return LoopbackReceiver(self.network, multicast_addr, mcast_port, self.ip, uncast_port, cb_mc, cb_uncast)
@@ -4,10 +4,11 @@ import threading
 import time
 
 from Logger import lg
-from Configuration import node_offline_timeout_s, MCAST_PORT, MCAST_GRP, UNCAST_PORT
+from Configuration import node_offline_timeout_s, MCAST_PORT, MCAST_GRP, UNCAST_PORT, IP_REFRESH_INTERVAL_S
 from Messaging import Message, DefaultMessageTypes, DefaultHeaders
 from Utils import getCurrentIpAddress, getNextFreePort
-from IPCommunication import IPSender, IPReceiver
+from Transport import Transport, UDPTransport
+from WireFormat import register_message_type
 from ReliableMulticast import RMulticast
 from LeaderElection import LeaderSubsystem
 from Peer import Peer
@@ -16,7 +17,8 @@ import MiddelwareEvents
 Main class
 """
 class Middleware:
-    def __init__(self, event_engine:MiddelwareEvents, cb_mcast_message_received, cb_uncast_message_received, cb_heartbeat_payload=None, heartbeat_rate_s=1, leader_control_rate_s=0.01):
+    def __init__(self, event_engine:MiddelwareEvents, cb_mcast_message_received, cb_uncast_message_received, cb_heartbeat_payload=None, heartbeat_rate_s=1, leader_control_rate_s=0.01,
+                 scheduler=None, transport: Transport = None):
         # Error checks
         if heartbeat_rate_s >= node_offline_timeout_s:
             ValueError("Heartbeat rate must be faster than the node offline_timeout")
@@ -27,6 +29,7 @@ class Middleware:
         # Settings
         self.heartbeat_rate_s = heartbeat_rate_s
         self.leader_control_rate_s = leader_control_rate_s
+        self.scheduler = scheduler
 
         # Other Properties
         self.uid = str(uuid.uuid1())
@@ -39,32 +42,42 @@ class Middleware:
         self.ext_cb_uncast_message_received = cb_uncast_message_received
 
         # Empty Initializations
-        self.ip = getCurrentIpAddress()
+        # The transport decides how messages travel and which address this node has, UDP sockets by default
+        self.transport = transport if transport is not None else UDPTransport()
+        self.ip = self.transport.ip
 
 
 
         # Network Interfaces
 
 
-        self.mc_sender = IPSender(MCAST_GRP, MCAST_PORT,self.unicast_port, None, self.uid)
+        self.mc_sender = self.transport.create_sender(MCAST_GRP, MCAST_PORT, self.unicast_port, self.uid,
+                                                      scheduler=self.scheduler)
         self.r_multicast = RMulticast(self.cb_mcast_message_received, self.mc_sender)
-        self.mc_rec = IPReceiver(MCAST_GRP, MCAST_PORT, getCurrentIpAddress(), self.unicast_port,
-                                        self.r_multicast.receive, self.cb_uncast_message_received)
+        self.mc_rec = self.transport.create_receiver(MCAST_GRP, MCAST_PORT, self.unicast_port,
+                                                     self.r_multicast.receive, self.cb_uncast_message_received)
 
 
 
 
-        # Threads
-        self.heartbeat_thread = threading.Thread(target=self._t_heartbeat, args=(self.ext_cb_heartbeat_payload,), kwargs={})
-        self.leader_thread = threading.Thread(target=self._t_leader_supervisor)
-
         # Helper Classes
         self.leader_subsystem = LeaderSubsystem(event_engine, sender=self.mc_sender, r_mcast=self.r_multicast, peer_list=self.peer_list, uid=self.uid,
                                                 cb_leader_found=self.cb_leader_found)
 
-        # Start Threads
-        self.heartbeat_thread.start()
-        self.leader_thread.start()
+        if self.scheduler is not None:
+            # Periodic work runs as tasks of the shared scheduler instead of own threads
+            self.scheduler.add_periodic("heartbeat", self.heartbeat_rate_s, self._send_heartbeat)
+            self.scheduler.add_periodic("leader_supervisor", self.leader_control_rate_s, self._supervise_leader, start_delay_s=2)
+            self.scheduler.add_periodic("ip_refresh", IP_REFRESH_INTERVAL_S, self._refresh_ip_address,
+                                        start_delay_s=IP_REFRESH_INTERVAL_S)
+        else:
+            # Threads
+            self.heartbeat_thread = threading.Thread(target=self._t_heartbeat)
+            self.leader_thread = threading.Thread(target=self._t_leader_supervisor)
+
+            # Start Threads
+            self.heartbeat_thread.start()
+            self.leader_thread.start()
 
     def __str__(self):
         entries = "<table>"
@@ -114,7 +127,8 @@ class Middleware:
         # Update peer list
         uid = msg.get_header(DefaultHeaders.UID)
         if self.peer_list.get(uid) == None:
-            self.peer_list[uid] = Peer(**msg.header)
+            self.peer_list[uid] = Peer(clock=self.scheduler.clock if self.scheduler is not None else time.time,
+                                       **msg.header)
             lg.info(f"Found new peer with uid {msg.get_header(DefaultHeaders.UID)} and IP {msg.get_header(DefaultHeaders.ORIGIN_IP)}")
         else:
             # todo Auch updaten, wenn die Nachricht kein HB war?
@@ -138,25 +152,77 @@ class Middleware:
         except Exception as e:
             lg.error(f'Multicast message received callback function failed: {e}')
 
+    """
+    Sends one heartbeat carrying the payload of the heartbeat callback.
+    """
+    def _send_heartbeat(self):
+        if self.ext_cb_heartbeat_payload is not None:
+            try:
+                message_body = self.ext_cb_heartbeat_payload()
+            except Exception as e:
+                lg.error(f'heartbeat payload callback function failed: {e}')
+                message_body = {"body": "error at cb function"}
+
+        else:
+            message_body = {"body": "not specified"}
+
+        msg = Message({DefaultHeaders.TYPE: DefaultMessageTypes.HEARTBEAT, DefaultHeaders.READABLE_NAME: self.readable_name}, message_body)
+        self.r_multicast.send(msg)
+
     """
     This thread sends out the heartbeat at the rate of self.heartbeat_rate_s
     """
-    def _t_heartbeat(self, cb_heartbeat_payload):
+    def _t_heartbeat(self):
+        last_ip_refresh = time.monotonic()
         while True:
-            if cb_heartbeat_payload is not None:
-                try:
-                    message_body = cb_heartbeat_payload()
-                except Exception as e:
-                    lg.error(f'heartbeat payload callback function failed: {e}')
-                    message_body = {"body": "error at cb function"}
-
-            else:
-                message_body = {"body": "not specified"}
-
-            msg = Message({DefaultHeaders.TYPE: DefaultMessageTypes.HEARTBEAT, DefaultHeaders.READABLE_NAME: self.readable_name}, message_body)
-            self.r_multicast.send(msg)
+            self._send_heartbeat()
+            if time.monotonic() - last_ip_refresh >= IP_REFRESH_INTERVAL_S:
+                last_ip_refresh = time.monotonic()
+                self._refresh_ip_address()
             time.sleep(self.heartbeat_rate_s)
 
+    def _refresh_ip_address(self):
+        if self.mc_sender.refresh_address():
+            self.ip = self.mc_sender.origin_ip
+
+    """
+    Checks whether a leader is present in the network and returns True if an election has to be started.
+    """
+    def _election_required(self):
+        start_election = False
+
+        if not self.leader_subsystem.leader_uid:
+            start_election = True
+            lg.info(f"Leader UID [{self.leader_subsystem.leader_uid}] not set in subsystem.")
+        elif self.get_leader() is None:
+            start_election = True
+            lg.info("Self.get_leader() returned none.")
+        elif not self.get_leader().is_online():
+            start_election = True
+            lg.info("Leader is no longer online.")
+        elif self.leader_subsystem.leader_election_necessary:
+            lg.info("Leader subsystem deemed election necessary.")
+            start_election = True
+        return start_election
+
+    """
+    Scheduler task of the leader supervision. The election must not block the shared loop, so the voting timeout is
+    waited for with call_later instead of sleeping.
+    """
+    def _supervise_leader(self):
+        if self.leader_subsystem.election_in_progress:
+            return
+        if self._election_required():
+            lg.info("Init leader election process.")
+            self.leader_subsystem.start_election()
+            self.scheduler.call_later(self.leader_subsystem.VOTING_TIMEOUT, self._conclude_election)
+
+    def _conclude_election(self):
+        if self.leader_subsystem.finish_election():
+            self.leader_subsystem.end_election()
+        else:
+            self.scheduler.call_later(self.leader_subsystem.VOTING_TIMEOUT, self.leader_subsystem.end_election)
+
     """
     This thread checks whether a leader is present in the network and initiates the election process if not.
     It also throws out every node from the node_list that has had a timeout.
@@ -165,21 +231,7 @@ class Middleware:
     def _t_leader_supervisor(self):
         time.sleep(2)
         while True:
-            start_election = False
-
-            if not self.leader_subsystem.leader_uid:
-                start_election = True
-                lg.info(f"Leader UID [{self.leader_subsystem.leader_uid}] not set in subsystem.")
-            elif self.get_leader() is None:
-                start_election = True
-                lg.info("Self.get_leader() returned none.")
-            elif not self.get_leader().is_online():
-                start_election = True
-                lg.info("Leader is no longer online.")
-            elif self.leader_subsystem.leader_election_necessary:
-                lg.info("Leader subsystem deemed election necessary.")
-                start_election = True
-            if start_election:
+            if self._election_required():
                 lg.info("Init leader election process.")
                 self.leader_subsystem.leader_election_alg()
             time.sleep(self.leader_control_rate_s)
@@ -5,13 +5,15 @@ from Messaging import DefaultMessageTypes, DefaultHeaders
 from Configuration import node_offline_timeout_s
 
 """
-Information about a peer
+Information about a peer. clock is the time source of the liveness check, the clock of the scheduler when the node runs
+on one.
 """
 class Peer:
-    def __init__(self, uid, origin_ip, port, readable_name="Not specified", **kwargs):
+    def __init__(self, uid, origin_ip, port, readable_name="Not specified", clock=time.time, **kwargs):
         self.uid = uid
         self.ip = origin_ip
-        self.last_alive = time.time()
+        self.clock = clock
+        self.last_alive = clock()
         self.heartbeats_received = 0
         self.port = port
         self.readable_name = readable_name
@@ -27,7 +29,7 @@ class Peer:
         return buf
 
     def update(self, origin_ip, **kwargs):
-        self.last_alive = time.time()
+        self.last_alive = self.clock()
 
         if self.ip != origin_ip:
             lg.info(f"The IP of node {self.uid} changed from {self.ip} to {origin_ip}.")
@@ -37,4 +39,4 @@ class Peer:
             self.heartbeats_received += 1
 
     def is_online(self):
-        return time.time() - self.last_alive < node_offline_timeout_s
\ No newline at end of file
+        return self.clock() - self.last_alive < node_offline_timeout_s
\ No newline at end of file
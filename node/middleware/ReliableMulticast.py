@@ -88,12 +88,9 @@ class RMulticast:
         if uid in self.latest_deliveries:
             seq_out = self.latest_deliveries[uid]
         else: # This happens if no seq is found e.g when node joined the group -> set seq to seq received -1
-            if seq - 1 == 0: # Edge Case: Two drones join simultaniosly -> cannot get msg with id 0
-                self.latest_deliveries[uid] = 1
-                seq_out = 1
-            else:
-                self.latest_deliveries[uid] = seq - 1
-                seq_out = seq - 1
+            # The first message of a peer has seq 1 and is delivered like any other (sequence numbers start at 1)
+            self.latest_deliveries[uid] = seq - 1
+            seq_out = seq - 1
         return seq_out
 
     '''
@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import threading
+import time
+
+from Logger import lg
+
+"""
+Clock of a TickScheduler that only moves when the scheduler advances it. The scheduler jumps from one deadline to the
+next instead of sleeping, so timeouts hold in simulated seconds no matter how long the tasks take in wall time.
+"""
+class SimulatedClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+"""
+A task of the TickScheduler. Periodic tasks have an interval, one shot tasks (call_later) have none.
+"""
+class ScheduledTask:
+    def __init__(self, name, callback, next_run, interval_s=None, scheduler=None):
+        self.name = name
+        self.callback = callback
+        self.next_run = next_run
+        self.interval_s = interval_s
+        self.cancelled = False
+        self.scheduler = scheduler
+
+        # Accounting
+        self.runs = 0
+        self.overruns = 0
+        self.missed_periods = 0
+        self.total_runtime_s = 0.0
+        self.max_runtime_s = 0.0
+
+    def __str__(self):
+        avg_ms = self.total_runtime_s / self.runs * 1000 if self.runs else 0
+        return f"{self.name}: runs {self.runs} | overruns {self.overruns} | missed {self.missed_periods} | " \
+               f"avg {avg_ms:.3f}ms | max {self.max_runtime_s * 1000:.3f}ms"
+
+    def cancel(self):
+        self.cancelled = True
+        if self.scheduler is not None:
+            self.scheduler.remove(self)
+
+
+"""
+Single threaded cooperative scheduler. Periodic tasks (physics, control, heartbeats, leader supervision) are kept in a
+heap ordered by their next deadline and executed from one loop, so a node does not need a thread per activity.
+Callbacks must not block, they share the loop with every other task.
+
+A task overruns when one execution takes longer than its interval. If a task starts so late that whole periods passed,
+those periods are skipped and counted as missed instead of being executed back to back.
+
+Deadlines are taken from clock, time.monotonic by default. With a SimulatedClock run_forever does not wait for the next
+deadline but advances the clock to it. Code that runs on the scheduler should take the time from scheduler.clock.
+"""
+class TickScheduler:
+    def __init__(self, name="scheduler", clock=None):
+        self.name = name
+        self.clock = clock if clock is not None else time.monotonic
+        self.simulated = isinstance(clock, SimulatedClock)
+        self.tasks = []
+        self.running = False
+        self.thread = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def __str__(self):
+        return "<br>".join(str(task) for task in self.tasks if task.interval_s is not None)
+
+    def _push(self, task: ScheduledTask):
+        with self._lock:
+            heapq.heappush(self._heap, (task.next_run, next(self._seq), task))
+        self._wakeup.set()
+
+    def add_periodic(self, name, interval_s, callback, start_delay_s=0.0):
+        task = ScheduledTask(name, callback, self.clock() + start_delay_s, interval_s, scheduler=self)
+        with self._lock:
+            self.tasks.append(task)
+        self._push(task)
+        return task
+
+    def call_later(self, delay_s, callback, name=None):
+        task = ScheduledTask(name or getattr(callback, '__name__', 'call_later'), callback, self.clock() + delay_s)
+        self._push(task)
+        return task
+
+    # Called by ScheduledTask.cancel, the entry in the heap is skipped once it is due
+    def remove(self, task: ScheduledTask):
+        with self._lock:
+            if task in self.tasks:
+                self.tasks.remove(task)
+
+    def set_interval(self, task: ScheduledTask, interval_s, run_now=False):
+        task.interval_s = interval_s
+        if run_now:
+            # The entry already in the heap becomes stale and is skipped
+            task.next_run = self.clock()
+            self._push(task)
+
+    def run_pending(self):
+        now = self.clock()
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                deadline, _, task = heapq.heappop(self._heap)
+            if task.cancelled or deadline != task.next_run:
+                continue
+
+            start = time.monotonic()
+            try:
+                task.callback()
+            except Exception as e:
+                lg.error(f"Scheduled task {task.name} failed: {e}")
+            runtime = time.monotonic() - start
+            end = self.clock()
+
+            task.runs += 1
+            task.total_runtime_s += runtime
+            task.max_runtime_s = max(task.max_runtime_s, runtime)
+
+            if task.interval_s is None:
+                continue
+            if runtime > task.interval_s:
+                task.overruns += 1
+            task.next_run = deadline + task.interval_s
+            if task.next_run <= end:
+                missed = int((end - task.next_run) / task.interval_s) + 1
+                task.missed_periods += missed
+                task.next_run += missed * task.interval_s
+            if not task.cancelled:
+                self._push(task)
+
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self.clock())
+
+    def run_forever(self):
+        self.running = True
+        while self.running:
+            timeout = self.run_pending()
+            if self.simulated:
+                if timeout is None:
+                    break
+                self.clock.advance(timeout)
+                continue
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def run_in_thread(self):
+        self.thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.running = False
+        self._wakeup.set()
@@ -0,0 +1,30 @@
+from IPCommunication import IPSender, IPReceiver
+from Utils import getCurrentIpAddress
+
+"""
+Creates the sender and the receiver of a Middleware. The middleware only talks to these two objects, so the network
+underneath can be exchanged: UDPTransport uses real sockets, Loopback.LoopbackTransport an in-memory network shared by
+many nodes in one process.
+
+ip is the address the node is known by, it is sent as origin of every message and peers reply to it.
+"""
+class Transport:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def create_sender(self, multicast_addr, mcast_port, uncast_port, uid, scheduler=None) -> IPSender:
+        raise NotImplementedError
+
+    def create_receiver(self, multicast_addr, mcast_port, uncast_port, cb_mc, cb_uncast):
+        raise NotImplementedError
+
+
+class UDPTransport(Transport):
+    def __init__(self):
+        super().__init__(getCurrentIpAddress())
+
+    def create_sender(self, multicast_addr, mcast_port, uncast_port, uid, scheduler=None):
+        return IPSender(multicast_addr, mcast_port, uncast_port, None, uid, scheduler=scheduler)
+
+    def create_receiver(self, multicast_addr, mcast_port, uncast_port, cb_mc, cb_uncast):
+        return IPReceiver(multicast_addr, mcast_port, self.ip, uncast_port, cb_mc, cb_uncast)
@@ -2,12 +2,18 @@ import socket
 
 from Configuration import UNCAST_PORT
 
+_current_ip_address = None
+
 """
-This function returns the IP Address of the current System
+This function returns the IP Address of the current System. The resolver lookup only runs on the first call and when
+refresh is set, e.g. by the periodic check for interface changes, every other call returns the cached address.
 """
-def getCurrentIpAddress():
-    h_name = socket.gethostname()
-    return socket.gethostbyname(h_name)
+def getCurrentIpAddress(refresh=False):
+    global _current_ip_address
+    if _current_ip_address is None or refresh:
+        h_name = socket.gethostname()
+        _current_ip_address = socket.gethostbyname(h_name)
+    return _current_ip_address
 
     #todo fix the problem when multiple networks exist
     #return "127.0.0.1"
@@ -0,0 +1,359 @@
+import base64
+import json
+import socket
+import struct
+import uuid
+from functools import lru_cache
+
+from Configuration import encoding, WIRE_FORMAT
+from Messaging import Message, DefaultHeaders, DefaultMessageTypes
+
+"""
+Binary encoding of a Message.
+
+Every datagram starts with a fixed header:
+
+    magic (B) | version (B) | type code (B) | flags (B) | origin ip (4s) | destination ip (4s) | port (H) | uid (16s) | seq (I)
+
+followed by the optional fields announced in flags (type name if it has no code, readable name, further headers), the
+acks as a count and (uid, seq) pairs and the body. Bodies are tagged values, dicts with exactly the keys x, y, z (what
+C3d.to_dict() produces) are packed as three float32 and integers take the smallest of 1, 2, 4 or 8 bytes that holds them. JSON datagrams start with '{' and are always accepted, so nodes
+with WIRE_FORMAT = 'json' can still talk to the others.
+
+bytes values are sent as they are after a 4 byte length, applications pack large tables (like formations) into one
+bytes value with uid_to_bytes and struct or numpy. In JSON they become {"__bytes__": base64 string}.
+"""
+WIRE_MAGIC = 0xD7
+WIRE_VERSION = 3
+# Several encoded messages in one datagram: magic (B) | version (B) | count (H), then length (H) and data per message
+BATCH_MAGIC = 0xD8
+
+_HEADER = struct.Struct('!BBBB4s4sH16sI')
+_BATCH_HEADER = struct.Struct('!BBH')
+_ACK = struct.Struct('!16sI')
+_COUNT = struct.Struct('!H')
+_BYTES_LENGTH = struct.Struct('!I')
+_INT8 = struct.Struct('!b')
+_INT16 = struct.Struct('!h')
+_INT32 = struct.Struct('!l')
+_INT = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+_VEC3 = struct.Struct('!3f')
+
+_FLAG_CUSTOM_TYPE = 0x01
+_FLAG_READABLE_NAME = 0x02
+_FLAG_EXTRA_HEADERS = 0x04
+
+# Headers that have a place in the fixed layout
+_LAYOUT_HEADERS = {DefaultHeaders.ORIGIN_IP, DefaultHeaders.DESTINATION_IP, DefaultHeaders.UNICAST_PORT,
+                   DefaultHeaders.UID, DefaultHeaders.TYPE, DefaultHeaders.READABLE_NAME}
+
+# Interned message types, code 0 means the message has no type. The codes are part of the protocol, never reuse one.
+_TYPE_CODES = {
+    DefaultMessageTypes.HEARTBEAT: 1,
+    DefaultMessageTypes.LEADER_ELECTION_MESSAGE: 2,
+    DefaultMessageTypes.LEADER_ANSWER_MESSAGE: 3,
+    DefaultMessageTypes.LEADER_COORDINATOR_MESSAGE: 4,
+    DefaultMessageTypes.NEGATIVE_ACK: 5,
+}
+_CUSTOM_TYPE_CODE = 255
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+
+_VEC3_KEYS = ('x', 'y', 'z')
+_JSON_BYTES_KEY = '__bytes__'
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+"""
+Message types of the application get a code to be sent without their name. Codes from 64 to 254 are free for the
+application, every node has to register the same types with the same codes.
+"""
+def register_message_type(name, code):
+    if not 64 <= code < _CUSTOM_TYPE_CODE:
+        raise ValueError(f"Application message type codes must be in [64, {_CUSTOM_TYPE_CODE}), got {code}")
+    if _TYPE_NAMES.get(code, name) != name or _TYPE_CODES.get(name, code) != code:
+        raise ValueError(f"Message type {name} or code {code} is already registered")
+    _TYPE_CODES[name] = code
+    _TYPE_NAMES[code] = name
+
+
+# A node only ever sees the uids of its peers, converting them once keeps UUID parsing out of the per message cost
+@lru_cache(maxsize=4096)
+def uid_to_bytes(uid):
+    return uuid.UUID(uid).bytes
+
+
+@lru_cache(maxsize=4096)
+def uid_from_bytes(data):
+    return str(uuid.UUID(bytes=data))
+
+
+# A multicast datagram is decoded by every receiver and its acks grow with the group, the decoded block is shared
+@lru_cache(maxsize=256)
+def _decode_acks(block):
+    return tuple((uid_from_bytes(ack_uid), ack_seq) for ack_uid, ack_seq in _ACK.iter_unpack(block))
+
+
+@lru_cache(maxsize=4096)
+def _ip_to_bytes(ip):
+    return socket.inet_aton(ip)
+
+
+def _pack_str(out, value):
+    data = value.encode(encoding)
+    out += _COUNT.pack(len(data))
+    out += data
+
+
+def _pack_value(out, value):
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        if -0x80 <= value < 0x80:
+            out += b'b'
+            out += _INT8.pack(value)
+        elif -0x8000 <= value < 0x8000:
+            out += b'h'
+            out += _INT16.pack(value)
+        elif -0x80000000 <= value < 0x80000000:
+            out += b'l'
+            out += _INT32.pack(value)
+        else:
+            out += b'i'
+            out += _INT.pack(value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += _FLOAT.pack(value)
+    elif isinstance(value, str):
+        out += b's'
+        _pack_str(out, value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out += b'B'
+        out += _BYTES_LENGTH.pack(len(value))
+        out += value
+    elif isinstance(value, dict):
+        if len(value) == 3 and all(k in value and isinstance(value[k], (int, float)) for k in _VEC3_KEYS):
+            out += b'v'
+            out += _VEC3.pack(value['x'], value['y'], value['z'])
+            return
+        out += b'D'
+        out += _COUNT.pack(len(value))
+        for key, item in value.items():
+            _pack_str(out, key)
+            _pack_value(out, item)
+    elif isinstance(value, (list, tuple)):
+        out += b'L'
+        out += _COUNT.pack(len(value))
+        for item in value:
+            _pack_value(out, item)
+    else:
+        raise WireFormatError(f"Cannot encode {type(value).__name__}")
+
+
+def _unpack_str(data, offset):
+    (length,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    return str(data[offset:offset + length], encoding), offset + length
+
+
+def _unpack_value(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'b':
+        return _INT8.unpack_from(data, offset)[0], offset + _INT8.size
+    if tag == b'h':
+        return _INT16.unpack_from(data, offset)[0], offset + _INT16.size
+    if tag == b'l':
+        return _INT32.unpack_from(data, offset)[0], offset + _INT32.size
+    if tag == b'i':
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == b'd':
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag == b's':
+        return _unpack_str(data, offset)
+    if tag == b'B':
+        (length,) = _BYTES_LENGTH.unpack_from(data, offset)
+        offset += _BYTES_LENGTH.size
+        if offset + length > len(data):
+            raise WireFormatError(f"Truncated bytes value, expected {length} bytes")
+        return bytes(data[offset:offset + length]), offset + length
+    if tag == b'v':
+        return dict(zip(_VEC3_KEYS, _VEC3.unpack_from(data, offset))), offset + _VEC3.size
+    if tag == b'D':
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        result = {}
+        for _ in range(count):
+            key, offset = _unpack_str(data, offset)
+            result[key], offset = _unpack_value(data, offset)
+        return result, offset
+    if tag == b'L':
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        result = []
+        for _ in range(count):
+            item, offset = _unpack_value(data, offset)
+            result.append(item)
+        return result, offset
+    raise WireFormatError(f"Unknown value tag {tag!r} at offset {offset - 1}")
+
+
+def encode_binary(message: Message):
+    header = message.header
+    msg_type = header.get(DefaultHeaders.TYPE)
+    type_code = 0 if msg_type is None else _TYPE_CODES.get(msg_type, _CUSTOM_TYPE_CODE)
+    extra_headers = {k: v for k, v in header.items() if k not in _LAYOUT_HEADERS}
+    flags = 0
+    if type_code == _CUSTOM_TYPE_CODE:
+        flags |= _FLAG_CUSTOM_TYPE
+    if DefaultHeaders.READABLE_NAME in header:
+        flags |= _FLAG_READABLE_NAME
+    if extra_headers:
+        flags |= _FLAG_EXTRA_HEADERS
+
+    out = bytearray(_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, type_code, flags,
+                                 _ip_to_bytes(header[DefaultHeaders.ORIGIN_IP]),
+                                 _ip_to_bytes(header[DefaultHeaders.DESTINATION_IP]),
+                                 header[DefaultHeaders.UNICAST_PORT], uid_to_bytes(header[DefaultHeaders.UID]),
+                                 message.seq))
+    if flags & _FLAG_CUSTOM_TYPE:
+        _pack_str(out, msg_type)
+    if flags & _FLAG_READABLE_NAME:
+        _pack_str(out, header[DefaultHeaders.READABLE_NAME])
+    if flags & _FLAG_EXTRA_HEADERS:
+        _pack_value(out, extra_headers)
+
+    acks = message.acks or {}
+    out += _COUNT.pack(len(acks))
+    for uid, seq in acks.items():
+        out += _ACK.pack(uid_to_bytes(uid), seq)
+    _pack_value(out, message.body)
+    return bytes(out)
+
+
+def decode_binary(data):
+    if len(data) < _HEADER.size:
+        raise WireFormatError(f"Datagram of {len(data)} bytes is shorter than the header")
+    magic, version, type_code, flags, origin_ip, destination_ip, port, uid, seq = _HEADER.unpack_from(data)
+    if magic != WIRE_MAGIC:
+        raise WireFormatError(f"Not a droneworks datagram (magic {magic:#x})")
+    if version != WIRE_VERSION:
+        raise WireFormatError(f"Unsupported wire format version {version}, this node speaks {WIRE_VERSION}")
+
+    header = {DefaultHeaders.ORIGIN_IP: socket.inet_ntoa(origin_ip), DefaultHeaders.UNICAST_PORT: port,
+              DefaultHeaders.DESTINATION_IP: socket.inet_ntoa(destination_ip),
+              DefaultHeaders.UID: uid_from_bytes(uid)}
+    offset = _HEADER.size
+    if flags & _FLAG_CUSTOM_TYPE:
+        header[DefaultHeaders.TYPE], offset = _unpack_str(data, offset)
+    elif type_code:
+        if type_code not in _TYPE_NAMES:
+            raise WireFormatError(f"Unknown message type code {type_code}")
+        header[DefaultHeaders.TYPE] = _TYPE_NAMES[type_code]
+    if flags & _FLAG_READABLE_NAME:
+        header[DefaultHeaders.READABLE_NAME], offset = _unpack_str(data, offset)
+    if flags & _FLAG_EXTRA_HEADERS:
+        extra_headers, offset = _unpack_value(data, offset)
+        header.update(extra_headers)
+
+    (ack_count,) = _COUNT.unpack_from(data, offset)
+    offset += _COUNT.size
+    acks = dict(_decode_acks(bytes(data[offset:offset + ack_count * _ACK.size])))
+    if len(acks) != ack_count:
+        raise WireFormatError(f"Truncated acks, expected {ack_count} got {len(acks)}")
+    offset += ack_count * _ACK.size
+    body, offset = _unpack_value(data, offset)
+    return Message(header, body, seq, acks)
+
+
+"""
+Encodes a message for sending. Messages the binary layout cannot hold (a uid that is not a UUID, a host name instead
+of an IPv4 address, an unsupported body type) are sent as JSON instead.
+"""
+def encode_message(message: Message, wire_format=None):
+    if (wire_format or WIRE_FORMAT) == 'binary':
+        try:
+            return encode_binary(message)
+        except (KeyError, ValueError, TypeError, OSError, struct.error):
+            pass
+    return json.dumps(message.__dict__, default=_json_default).encode(encoding)
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {_JSON_BYTES_KEY: base64.b64encode(value).decode('ascii')}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and _JSON_BYTES_KEY in obj:
+        return base64.b64decode(obj[_JSON_BYTES_KEY], validate=True)
+    return obj
+
+
+def decode_message(data):
+    if data[:1] == b'{':
+        try:
+            message = Message(**json.loads(str(data, encoding), object_hook=_json_object_hook))
+        except (ValueError, TypeError, UnicodeDecodeError) as e:
+            raise WireFormatError(f"Malformed JSON datagram: {e}") from e
+        if not isinstance(message.header, dict):
+            raise WireFormatError(f"Malformed JSON datagram: header is a {type(message.header).__name__}")
+        return message
+    try:
+        return decode_binary(data)
+    except WireFormatError:
+        raise
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        raise WireFormatError(f"Malformed datagram: {e}") from e
+
+
+def batch_size(encoded_messages):
+    return _BATCH_HEADER.size + sum(_COUNT.size + len(data) for data in encoded_messages)
+
+
+def encode_batch(encoded_messages):
+    parts = [_BATCH_HEADER.pack(BATCH_MAGIC, WIRE_VERSION, len(encoded_messages))]
+    for data in encoded_messages:
+        parts.append(_COUNT.pack(len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+
+"""
+Decodes a received datagram, which holds either one message or a batch. Returns the list of messages.
+"""
+def decode_datagram(data):
+    if data[:1] != bytes((BATCH_MAGIC,)):
+        return [decode_message(data)]
+    if len(data) < _BATCH_HEADER.size:
+        raise WireFormatError(f"Batch of {len(data)} bytes is shorter than its header")
+    _, version, count = _BATCH_HEADER.unpack_from(data)
+    if version != WIRE_VERSION:
+        raise WireFormatError(f"Unsupported wire format version {version}, this node speaks {WIRE_VERSION}")
+    view = memoryview(data)
+    offset = _BATCH_HEADER.size
+    messages = []
+    for _ in range(count):
+        if offset + _COUNT.size > len(data):
+            raise WireFormatError(f"Truncated batch, got {len(messages)} of {count} messages")
+        (length,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        if offset + length > len(data):
+            raise WireFormatError(f"Truncated batch, got {len(messages)} of {count} messages")
+        messages.append(decode_message(view[offset:offset + length]))
+        offset += length
+    return messages
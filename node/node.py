@@ -2,40 +2,67 @@
 Contains the main Object that holds all functionality.
 """
 
-from middleware.Middleware import Middleware, Message, DefaultMessageTypes, getCurrentIpAddress
+from middleware.Middleware import Middleware, Message, DefaultMessageTypes, getCurrentIpAddress, register_message_type
 from middleware.MiddelwareEvents import MiddlewareEvents
+from middleware.Scheduler import TickScheduler
 import threading
 from middleware.Logger import lg
 
 from engine import World, FlightController, C3d
 import random
-from dash_wrapper import t_dash_interface, set_leader_content, set_slave_content
+import numpy as np
 from middleware.MiddelwareEvents import MiddlewareEvents
 
-from middleware.Configuration import UNCAST_PORT
 from middleware.IPCommunication import DefaultHeaders
 
 import shape_logic
+from assignment import assign_targets
+from choreography import compile_show, ChoreographyPlayer, encode_formation, formation_destination
+from telemetry import TelemetryEncoder, TelemetryDecoder
 
 class NodeState:
     INIT = 'init'
 
 class CustomMessageTypes:
     NEW_POSITION = "NEW_POSITION"
+    FORMATION = "FORMATION"
+
+register_message_type(CustomMessageTypes.NEW_POSITION, 64)
+register_message_type(CustomMessageTypes.FORMATION, 65)
+
+# Distance in meters every drone has to report before a show step counts as converged
+SHOW_CONVERGENCE_TOLERANCE = 0.5
 
 class DWNode:
-    def __init__(self, world_kwargs=None):
+    """
+    world replaces the World built from world_kwargs, e.g. a drone view of a SwarmWorld shared by simulated nodes.
+    transport is passed on to the middleware. Without the dash interface (enable_dash=False) the node neither starts
+    the web server nor imports dash.
+    """
+    def __init__(self, world_kwargs=None, scheduler=None, world=None, transport=None, enable_dash=True):
         self.State = NodeState.INIT
+        self.enable_dash = enable_dash
         self.node_list = dict()
+        self.telemetry = TelemetryEncoder()
+        self.telemetry_decoders = dict()
         self.event_engine = MiddlewareEvents()
 
+        # Physics, control and the periodic middleware work share one scheduler loop
+        if scheduler is None:
+            scheduler = TickScheduler(name="node-scheduler")
+            scheduler.run_in_thread()
+        self.scheduler = scheduler
+
         # Engine
         x = random.uniform(-10, 10)
         y = random.uniform(-10, 10)
         z = random.uniform(-10, 10)
 
         self.world = None
-        if world_kwargs is None:
+        if world is not None:
+            self.world = world
+            self.flight_controller = FlightController(world_ref=self.world, start_destination=self.world.position)
+        elif world_kwargs is None:
             self.world = World(max_drone_force=C3d(1.5, 1.5, 1.5), weight=0.2, start_position=C3d(x, y, z))
             self.flight_controller = FlightController(world_ref=self.world, start_destination=C3d(x, y, z))
         else:
@@ -43,49 +70,94 @@ class DWNode:
             self.flight_controller = FlightController(world_ref=self.world, start_destination=C3d(0, 0, 0))
 
         self.dash_thread = None
-        self.world.run_simulation()
-        self.flight_controller.run_controller()
+        self.world.run_simulation(self.scheduler)
+        self.flight_controller.run_controller(self.scheduler)
 
-        self.middleware = Middleware(self.event_engine, self.cb_multicast_message_received_handler, self.cb_uncast_message_received, self.cb_heartbeat_payload)
+        self.middleware = Middleware(self.event_engine, self.cb_multicast_message_received_handler, self.cb_uncast_message_received, self.cb_heartbeat_payload,
+                                     scheduler=self.scheduler, transport=transport)
         self.readable_name = self.middleware.readable_name
 
         # Shapes
         self.available_shapes = shape_logic.get_available_shapes()
         self.selected_shape = None
+        self.choreography = None
 
         self.event_engine.register_event(MiddlewareEvents.SELF_ELECTED_AS_LEADER, self.handler_self_elected_as_leader)
         self.event_engine.register_event(MiddlewareEvents.LOST_LEADER_STATUS, self.handler_lost_leader_status)
 
-        self.dash_thread = threading.Thread(target=t_dash_interface, args=(getCurrentIpAddress(), self.node_list, self.cb_new_shape_selected, self.available_shapes, ))
-        self.dash_thread.start()
+        if self.enable_dash:
+            from dash_wrapper import t_dash_interface
+            self.dash_thread = threading.Thread(target=t_dash_interface, args=(getCurrentIpAddress(), self.node_list, self.cb_new_shape_selected, self.available_shapes, ))
+            self.dash_thread.start()
 
         print(f"Node init complete. Readable Name: {self.readable_name}, IP: {self.middleware.ip}")
 
 
 
     def handler_self_elected_as_leader(self):
-        lg.info("Starting Dash interface as leader.")
-        set_leader_content()
+        if self.enable_dash:
+            from dash_wrapper import set_leader_content
+            lg.info("Starting Dash interface as leader.")
+            set_leader_content()
+        # Only the leader assigns shapes, parse them once now so switching shapes is instant
+        threading.Thread(target=shape_logic.preload_shapes, daemon=True).start()
 
     def handler_lost_leader_status(self):
-        lg.info("Starting Dash interface as slave.")
-        set_slave_content()
+        if self.enable_dash:
+            from dash_wrapper import set_slave_content
+            lg.info("Starting Dash interface as slave.")
+            set_slave_content()
+        self.stop_choreography()
 
     def cb_new_shape_selected(self, shape):
         lg.info(f"New shape selected: {shape}")
+        self.stop_choreography()
         self.selected_shape = shape
-        ss = shape_logic.ShapeStep(svg_path=f'shapes/{shape}', height_level=2)
-        pos = ss.get_positions(len(self.node_list))
-        for key, i in zip(self.node_list, range(len(self.node_list))):
-            peer = self.node_list[key]["peer"]
-            lg.info(f"Sending {peer.ip} to destination {str(pos[i])}")
-            self.middleware.mc_sender.send_message_unicast(peer.ip, UNCAST_PORT, {'dest': pos[i].__dict__},
-                                                           {DefaultHeaders.TYPE: CustomMessageTypes.NEW_POSITION})
+        ss = shape_logic.load_shape(shape, height_level=2)
+        uids = list(self.node_list)
+        targets = ss.get_position_array(len(uids))
+        # Pair drones and targets by their last reported positions to avoid long crossing flights
+        assignment = assign_targets(self._reported_positions(uids), targets)
+        self._send_destinations(uids, targets[assignment])
+
+    """
+    Plays a sequence of ShowSteps with the currently known drones. All assignments are computed here, the scheduler
+    only dispatches the precomputed destinations once the heartbeats show that the swarm has converged.
+    """
+    def start_choreography(self, steps, loop=False):
+        self.stop_choreography()
+        uids = list(self.node_list)
+        show = compile_show(steps, self._reported_positions(uids), loop=loop)
+        self.choreography = ChoreographyPlayer(show, dispatch=lambda index, dest: self._send_destinations(uids, dest),
+                                               converged=lambda dest: self._converged(uids, dest),
+                                               scheduler=self.scheduler)
+        self.choreography.start()
+        return self.choreography
+
+    def stop_choreography(self):
+        if self.choreography is not None:
+            self.choreography.stop()
+            self.choreography = None
+
+    def _reported_positions(self, uids):
+        return [[p['x'], p['y'], p['z']] for p in (self.node_list[uid]["pos"] for uid in uids)]
+
+    def _converged(self, uids, destinations):
+        distance = np.linalg.norm(np.asarray(self._reported_positions(uids)) - destinations, axis=1)
+        return bool((distance <= SHOW_CONVERGENCE_TOLERANCE).all())
+
+    """
+    Sends the destinations of all drones as one formation message over the reliable multicast. The message is handed to
+    the scheduler loop, which also sends the heartbeats, so the reliable multicast is only used from one thread.
+    """
+    def _send_destinations(self, uids, destinations):
+        lg.info(f"Sending formation with {len(uids)} destinations")
+        msg = Message({DefaultHeaders.TYPE: CustomMessageTypes.FORMATION}, encode_formation(uids, destinations))
+        self.scheduler.call_later(0, lambda: self.middleware.r_multicast.send(msg), name="send_formation")
 
 
     def cb_heartbeat_payload(self):
-        return {"pos": self.world.position.__dict__,
-         "vel": str(self.world.velocity), "acc": str(self.world.acceleration)}
+        return self.telemetry.encode(self.world.position, self.world.velocity, self.world.acceleration)
 
     def cb_uncast_message_received(self, msg:Message):
         if msg.get_header(DefaultHeaders.TYPE) == CustomMessageTypes.NEW_POSITION:
@@ -98,10 +170,28 @@ class DWNode:
     def cb_multicast_message_received_handler(self, msg_received: Message):
         if msg_received.header['type'] == DefaultMessageTypes.HEARTBEAT:
             uid = msg_received.header['uid']
-            self.node_list[uid] = dict()
-            self.node_list[uid]["pos"] = msg_received.body['pos']
-            self.node_list[uid]["vel"] = msg_received.body['vel']
-            self.node_list[uid]["acc"] = msg_received.body['acc']
+            decoder = self.telemetry_decoders.get(uid)
+            if decoder is None:
+                decoder = self.telemetry_decoders[uid] = TelemetryDecoder()
+                # The new peer has not seen our last keyframe, send the next one now instead of at the end of the
+                # keyframe interval
+                self.telemetry.force_keyframe()
+            telemetry = decoder.decode(msg_received.body)
+            if telemetry is None:
+                # Waiting for the next keyframe of this node
+                return
+            self.node_list[uid] = telemetry
             self.node_list[uid]["peer"] = self.middleware.peer_list[uid]
+        elif msg_received.header['type'] == CustomMessageTypes.FORMATION:
+            try:
+                destination = formation_destination(msg_received.body, str(self.middleware.uid))
+            except ValueError as e:
+                lg.warning(f"Ignoring malformed formation: {e}")
+                return
+            if destination is None:
+                lg.info("Not part of the new formation.")
+                return
+            lg.info(f"Received new destination from leader: {destination}")
+            self.flight_controller.go_to_point(C3d(*destination))
         else:
             lg.error(f'Message rec "{msg_received.body}".')
@@ -0,0 +1,119 @@
+"""
+Offline compiler for the formation shapes. Every SVG in the shapes directory is flattened into a polyline and written to
+shapes/compiled/<name>.npy as a float64 (M,3) array of x, y and the cumulative arc length. ShapeStep memory maps these
+files, so nodes do not have to parse SVGs at runtime. Run from the node directory after changing a shape:
+
+    python shape_compiler.py
+"""
+import os
+import sys
+
+import numpy as np
+from svg.path import parse_path
+from svg.path.path import Move, Linear
+from xml.dom import minidom
+
+from shape_logic import compiled_path
+
+# Maximum distance in SVG units between a curve and the polyline that replaces it
+CURVE_TOLERANCE = 0.05
+
+
+def _outlined(doc, tag):
+    # Basic shapes without a stroke are backgrounds (e.g. a 100% rect) and not part of the drawing
+    return [e for e in doc.getElementsByTagName(tag) if e.getAttribute('stroke') != 'none']
+
+
+def _element_path_strings(doc):
+    # Path data of every drawable element, basic shapes are converted to equivalent paths
+    path_strings = [path.getAttribute('d') for path in doc.getElementsByTagName('path')]
+    for tag in ('ellipse', 'circle'):
+        for e in _outlined(doc, tag):
+            cx, cy = float(e.getAttribute('cx') or 0), float(e.getAttribute('cy') or 0)
+            rx = float(e.getAttribute('rx') or e.getAttribute('r') or 0)
+            ry = float(e.getAttribute('ry') or e.getAttribute('r') or 0)
+            path_strings.append(f"M{cx - rx},{cy} A{rx},{ry} 0 1,0 {cx + rx},{cy} A{rx},{ry} 0 1,0 {cx - rx},{cy} Z")
+    for e in _outlined(doc, 'rect'):
+        x, y = float(e.getAttribute('x') or 0), float(e.getAttribute('y') or 0)
+        w, h = float(e.getAttribute('width') or 0), float(e.getAttribute('height') or 0)
+        path_strings.append(f"M{x},{y} h{w} v{h} h{-w} Z")
+    for e in _outlined(doc, 'line'):
+        path_strings.append(f"M{e.getAttribute('x1') or 0},{e.getAttribute('y1') or 0} "
+                            f"L{e.getAttribute('x2') or 0},{e.getAttribute('y2') or 0}")
+    for tag, close in (('polyline', ''), ('polygon', ' Z')):
+        for e in _outlined(doc, tag):
+            points = e.getAttribute('points').strip()
+            if points:
+                path_strings.append(f"M{points}{close}")
+    return path_strings
+
+
+def _flatten_curve(segment, tolerance):
+    # Adaptive subdivision: split until the curve midpoint is within tolerance of the chord midpoint
+    points = []
+    stack = [(0.0, 1.0, segment.point(0.0), segment.point(1.0), 0)]
+    while stack:
+        t0, t1, p0, p1, depth = stack.pop()
+        tm = (t0 + t1) / 2
+        pm = segment.point(tm)
+        # A minimum depth keeps S-shaped curves from looking flat at their midpoint
+        if (depth >= 3 and abs(pm - (p0 + p1) / 2) <= tolerance) or depth >= 16:
+            points.append(p1)
+        else:
+            stack.append((tm, t1, pm, p1, depth + 1))
+            stack.append((t0, tm, p0, pm, depth + 1))
+    return points
+
+
+"""
+Reads an SVG and flattens all of its paths into one polyline. Returns the vertices as (M,2) array and the arc length at
+every vertex. Moves between subpaths do not add to the arc length, so no drone is placed on the jump.
+"""
+def parse_svg_polyline(svg_path, tolerance=CURVE_TOLERANCE):
+    doc = minidom.parse(svg_path)
+    path_strings = _element_path_strings(doc)
+    doc.unlink()
+
+    vertices = []
+    lengths = []
+    for path_string in path_strings:
+        for e in parse_path(path_string):
+            if isinstance(e, Move):
+                vertices.append(e.end)
+                lengths.append(0.0)
+                continue
+            if not vertices:
+                vertices.append(e.start)
+                lengths.append(0.0)
+            if isinstance(e, Linear):
+                points = [e.end]
+            else:
+                points = _flatten_curve(e, tolerance)
+            for point in points:
+                lengths.append(abs(point - vertices[-1]))
+                vertices.append(point)
+
+    if not vertices:
+        return np.zeros((0, 2)), np.zeros(0)
+    vertices = np.array(vertices)
+    return np.column_stack((vertices.real, vertices.imag)), np.cumsum(lengths)
+
+
+def compile_shape(svg_path, tolerance=CURVE_TOLERANCE):
+    points, cumulative_lengths = parse_svg_polyline(svg_path, tolerance)
+    out_path = compiled_path(svg_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    np.save(out_path, np.column_stack((points, cumulative_lengths)))
+    return out_path
+
+
+def compile_shapes(shapedir='shapes'):
+    compiled = []
+    for shape in sorted(f for f in os.listdir(shapedir) if f.endswith('.svg')):
+        compiled.append(compile_shape(os.path.join(shapedir, shape)))
+    return compiled
+
+
+if __name__ == '__main__':
+    for path in compile_shapes(sys.argv[1] if len(sys.argv) > 1 else 'shapes'):
+        print(f"Compiled {path} ({os.path.getsize(path)} bytes)")
@@ -1,79 +1,159 @@
 import os
+from functools import lru_cache
 
-from svg.path import parse_path
-from svg.path.path import Line
-from xml.dom import minidom
 from engine import C3d
-import matplotlib.pyplot as plt
 import numpy as np
 
-plt.style.use('seaborn-whitegrid')
 shapedir = 'shapes'
 
+# Default world area ((x_min, y_min), (x_max, y_max)) in meters the shapes are fitted into
+DEFAULT_BOUNDS = ((-20.0, -20.0), (20.0, 20.0))
+# Drones closer than this along the outline are moved to an additional height layer
+DEFAULT_MIN_SPACING = 1.0
+
+
+def compiled_path(svg_path):
+    directory, name = os.path.split(svg_path)
+    return os.path.join(directory, 'compiled', os.path.splitext(name)[0] + '.npy')
 
-class ShapeStep:
-    def __init__(self, height_level, svg_path):
-        doc = minidom.parse(svg_path)
-        path_strings = [path.getAttribute('d') for path in doc.getElementsByTagName('path')]
-        doc.unlink()
 
-        self.total_length = 0
-        self.lines = []
-        for path_string in path_strings:
-            path = parse_path(path_string)
+"""
+Flattened polyline of a shape: (M,2) vertices and the cumulative arc length at every vertex. The compiled file from
+shape_compiler.py is memory mapped when it is at least as new as the SVG, otherwise the SVG is parsed.
+"""
+def load_polyline(svg_path):
+    npy_path = compiled_path(svg_path)
+    if os.path.exists(npy_path) and os.stat(npy_path).st_mtime_ns >= os.stat(svg_path).st_mtime_ns:
+        data = np.load(npy_path, mmap_mode='r')
+        return data[:, :2], data[:, 2]
 
-            for e in path:
-                if isinstance(e, Line):
-                    self.total_length += e.length()
-                    self.lines.append(e)
+    # Imported lazily so nodes running on compiled shapes do not need the SVG parser
+    from shape_compiler import parse_svg_polyline
+    return parse_svg_polyline(svg_path)
+
+
+"""
+Places drones evenly along the outline of a shape. The drawing is scaled uniformly (aspect ratio kept) and centered
+into the world bounding box ((x_min, y_min), (x_max, y_max)), the SVG y axis points down and is flipped. If the outline
+is too short for all drones at min_spacing, the swarm is split over several copies of the outline stacked layer_spacing
+apart above height_level.
+"""
+class ShapeStep:
+    def __init__(self, height_level, svg_path, bounds=DEFAULT_BOUNDS, min_spacing=DEFAULT_MIN_SPACING,
+                 layer_spacing=None):
+        self.points, self.cumulative_lengths = load_polyline(svg_path)
+        self.total_length = float(self.cumulative_lengths[-1]) if len(self.cumulative_lengths) else 0.0
 
         self.height_level = height_level
+        self.bounds = bounds
+        self.min_spacing = min_spacing
+        self.layer_spacing = min_spacing if layer_spacing is None else layer_spacing
+        self.scale, self.offset = self._fit_to_bounds()
+        # get_position_array results per drone count
+        self._positions_cache = dict()
+
+    def _fit_to_bounds(self):
+        # world = points * scale + offset, with scale negative on y for the flip
+        (x_min, y_min), (x_max, y_max) = self.bounds
+        if len(self.points) == 0:
+            return np.array([1.0, -1.0]), np.array([(x_min + x_max) / 2, (y_min + y_max) / 2])
+        low = self.points.min(axis=0)
+        high = self.points.max(axis=0)
+        extent = high - low
+        ratios = [(x_max - x_min) / extent[0] if extent[0] > 0 else np.inf,
+                  (y_max - y_min) / extent[1] if extent[1] > 0 else np.inf]
+        scale = min(ratios) if min(ratios) < np.inf else 1.0
+        center = (low + high) / 2
+        offset = np.array([(x_min + x_max) / 2 - center[0] * scale, (y_min + y_max) / 2 + center[1] * scale])
+        return np.array([scale, -scale]), offset
+
+    @property
+    def world_length(self):
+        return self.total_length * self.scale[0]
+
+    def layer_count(self, number_of_drones):
+        if self.world_length == 0 or self.min_spacing <= 0:
+            return 1
+        return max(1, int(np.ceil(number_of_drones * self.min_spacing / self.world_length)))
+
+    def get_position_array(self, number_of_drones):
+        if number_of_drones not in self._positions_cache:
+            positions = self._compute_positions(number_of_drones)
+            positions.flags.writeable = False
+            self._positions_cache[number_of_drones] = positions
+        return self._positions_cache[number_of_drones]
 
     def get_positions(self, number_of_drones):
-        coords = []
-        gap = self.total_length / number_of_drones
-        overlap = 0
-        for line in self.lines:
-            coords.append(C3d(line.start.real, line.start.imag, self.height_level))
-            a = np.array([line.start.real, line.start.imag])
-            b = np.array([line.end.real, line.end.imag])
-            s = b - a
-            norm = np.linalg.norm(s)
-            s_norm = s / norm
-            fitting = True
-            i = 0
-            while fitting:
-                scale = overlap + gap * i
-                if scale > norm:
-                    overlap = norm - (overlap + gap * (i-1))
-                    fitting = False
-                else:
-                    new_point = a + s_norm * scale
-                    coords.append(C3d(new_point[0], new_point[1], self.height_level))
-                    i += 1
-        return coords
+        # Fresh vectors on every call, callers are free to modify them
+        return [C3d(*p) for p in self.get_position_array(number_of_drones).tolist()]
+
+    def _compute_positions(self, number_of_drones):
+        positions = np.empty((number_of_drones, 3))
+        if len(self.points) == 0:
+            positions[:, :2] = self.offset
+            positions[:, 2] = self.height_level
+            return positions
+
+        # Drones are split over the layers as evenly as possible and spaced evenly along the outline of their layer
+        layers = self.layer_count(number_of_drones)
+        drone = np.arange(number_of_drones)
+        layer = drone * layers // number_of_drones
+        per_layer = np.bincount(layer, minlength=layers)
+        rank = drone - (np.cumsum(per_layer) - per_layer)[layer]
+        positions[:, 2] = self.height_level + layer * self.layer_spacing
+
+        if len(self.points) == 1 or self.total_length == 0:
+            positions[:, :2] = self.points[0]
+        else:
+            # The segment containing each distance is found in a single pass
+            cum = self.cumulative_lengths
+            distances = rank * (self.total_length / per_layer[layer])
+            idx = np.clip(np.searchsorted(cum, distances, side='right') - 1, 0, len(cum) - 2)
+            seg_len = cum[idx + 1] - cum[idx]
+            t = np.divide(distances - cum[idx], seg_len, out=np.zeros(number_of_drones), where=seg_len > 0)
+            start = self.points[idx]
+            positions[:, :2] = start + (self.points[idx + 1] - start) * t[:, None]
+        positions[:, :2] = positions[:, :2] * self.scale + self.offset
+        return positions
 
 
 def get_available_shapes():
-    return os.listdir(shapedir)
+    return sorted(f for f in os.listdir(shapedir) if f.endswith('.svg'))
+
+
+"""
+Parsed shapes are cached by path, modification time and placement parameters. A changed file gets a new mtime and is
+parsed again, the stale entry is evicted by the LRU.
+"""
+@lru_cache(maxsize=64)
+def _load_shape_step(svg_path, mtime, height_level, bounds, min_spacing):
+    return ShapeStep(height_level=height_level, svg_path=svg_path, bounds=bounds, min_spacing=min_spacing)
+
+
+def load_shape(shape, height_level=2, bounds=DEFAULT_BOUNDS, min_spacing=DEFAULT_MIN_SPACING):
+    svg_path = os.path.join(shapedir, shape)
+    bounds = tuple(tuple(corner) for corner in bounds)
+    return _load_shape_step(svg_path, os.stat(svg_path).st_mtime_ns, height_level, bounds, min_spacing)
+
+
+def preload_shapes(height_level=2):
+    for shape in get_available_shapes():
+        load_shape(shape, height_level)
 
 
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    plt.style.use('seaborn-whitegrid')
+
     while True:
         print("Select one of the folowing shapes:")
-        paths = os.listdir(shapedir)
+        paths = get_available_shapes()
         for path, i in zip(paths, range(len(paths))):
             print(f'[{i}]: {path}')
         idx = input()
         st = ShapeStep(svg_path=f'{shapedir}/{paths[int(idx)]}', height_level= 2)
-        poss = st.get_positions(100)
-        my_list = []
-        for pos in poss:
-            print(pos)
-            my_list.append(pos.to_numpy_array())
-
-        arr = np.array(my_list)
+        arr = st.get_position_array(100)
+        print(arr)
         plt.plot(arr[:,0], arr[:,1], 'o', color='black')
-        plt.gca().invert_yaxis()
         plt.gca().set_aspect('equal', adjustable='box')
         plt.show()
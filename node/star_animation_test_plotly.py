@@ -11,44 +11,32 @@ import plotly.express as px
 
 import numpy as np
 
-from engine import World, FlightController, C3d
-from shape_logic import ShapeStep
+from engine import SwarmWorld, SwarmFlightController, C3d
+from collision import CollisionAvoidance
+from choreography import compile_show, ChoreographyPlayer, ShowStep
+from middleware.Scheduler import TickScheduler
 
 n_drones = 97
-w_list = []
-fc_list = []
-for i in range(n_drones):
-    world = World(max_drone_force=C3d(1.5, 1.5, 0.1), weight=0.2, start_position=C3d(0, 0, np.random.uniform(-20, 20)), disable_logging=True)
-    w_list.append(world)
-    fc = FlightController(world_ref=world, start_destination=C3d(0, 0, 0))
-    fc_list.append(fc)
-    world.run_simulation()
-    fc.run_controller()
-
-
-def positions():
-    st_big = ShapeStep(svg_path=f'shapes/star.svg', height_level=2)
-    st_small = ShapeStep(svg_path=f'shapes/star_small.svg', height_level=2)
-    corr = n_drones-7
-    pos_big = st_big.get_positions(corr)
-    print(f"pos_len: {len(pos_big)}")
-    pos_small = st_small.get_positions(corr)
-    for elm in pos_small:
-        elm/10
-    for elm in pos_big:
-        elm/10
-
-    while True:
-        for i in range(n_drones):
-            fc_list[i].go_to_point(pos_big[i])
-        time.sleep(15)
-        for i in range(n_drones):
-            fc_list[i].go_to_point(pos_small[i])
-        time.sleep(15)
-
-
-FC_thread = threading.Thread(target=positions)
-FC_thread.start()
+start_positions = np.zeros((n_drones, 3))
+start_positions[:, 2] = np.random.uniform(-20, 20, n_drones)
+swarm = SwarmWorld(n_drones, max_drone_force=C3d(1.5, 1.5, 0.1), weight=0.2, start_positions=start_positions, disable_lg=True)
+# The drones cross each other between the shapes, the safety radius stays below the spacing of the small star
+swarm_fc = SwarmFlightController(swarm, start_destinations=C3d(0, 0, 0),
+                                 collision_avoidance=CollisionAvoidance(safety_radius=0.4))
+swarm.run_simulation()
+swarm_fc.run_controller()
+
+
+# Both stars are centered in the plotted area, the small one keeps the outline in a single layer
+show = compile_show([ShowStep('star.svg', hold_s=1, timeout_s=15, bounds=((19, 11), (60, 50))),
+                     ShowStep('star_small.svg', hold_s=1, timeout_s=15, bounds=((33, 25), (47, 38)), min_spacing=0.5)],
+                    start_positions, loop=True)
+scheduler = TickScheduler(name="show")
+# Switch shapes as soon as the swarm has arrived, but at least every 15 seconds
+player = ChoreographyPlayer(show, dispatch=lambda index, destinations: swarm_fc.set_destinations(destinations),
+                            converged=lambda destinations: swarm_fc.arrival_future.done(), scheduler=scheduler)
+player.start()
+scheduler.run_in_thread()
 
 # Plotly dash server
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -121,10 +109,7 @@ app.layout = dbc.Container(
     Output("scatter-plot", "figure"),
     [Input("interval-component", 'n_intervals')])
 def update_bar_chart(n_interval):
-    coords = []
-    for i in range(n_drones):
-        coords.append(w_list[i].position.to_numpy_array())
-    arr = np.array(coords)
+    arr = swarm.position.copy()
     # Change between 2D and 3D
     #fig = px.scatter(x=arr[:, 0], y=arr[:, 1], width=1500, height=1200, range_y=[0,60], range_x=[0, 75])
     fig = px.scatter_3d(x=arr[:, 0], y=arr[:, 1], z=arr[:, 2], width=1500, height=1200, range_y=[0,60], range_x=[0, 75], range_z=[-25, 25])
@@ -0,0 +1,160 @@
+import argparse
+import collections
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+# The middleware modules import each other without the package prefix, like in main.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'middleware'))
+
+from engine import SwarmWorld, C3d
+from node import DWNode
+from middleware.Loopback import LoopbackNetwork, LoopbackTransport
+from middleware.Scheduler import TickScheduler, SimulatedClock
+from middleware.Logger import lg
+
+
+"""
+Runs a whole swarm of DWNodes in one process. Every node has its own Middleware with a LoopbackTransport, all of them
+share one LoopbackNetwork, one SwarmWorld for the physics and one TickScheduler. Nothing is sent over the network and
+no thread is started per node, so election, reliable multicast and formation dispatch can be load tested with
+hundreds or thousands of nodes.
+
+The scheduler runs in the thread that calls run_for / run_until. The network arguments are passed on to
+LoopbackNetwork. Every delivery is a scheduler task, so a large swarm cannot keep up with wall-clock time. By default
+the scheduler runs on a SimulatedClock: heartbeats, liveness and election timeouts, network delays and the physics all
+see simulated seconds and a slow loop only makes the run take longer. With simulated_time=False the swarm runs in real
+time, check scheduler_lag_s in the report before trusting timeout-driven results.
+"""
+class SwarmHarness:
+    def __init__(self, n_nodes, loss=0.0, delay_s=0.0005, jitter_s=0.0, reorder=0.0, seed=None, area=10.0,
+                 log_level=logging.WARNING, simulated_time=True):
+        lg.setLevel(log_level)
+        self.scheduler = TickScheduler(name="swarm-harness", clock=SimulatedClock() if simulated_time else None)
+        self.network = LoopbackNetwork(self.scheduler, loss=loss, delay_s=delay_s, jitter_s=jitter_s, reorder=reorder,
+                                       seed=seed)
+        rng = np.random.default_rng(seed)
+        self.swarm = SwarmWorld(n_nodes, weight=0.2, max_drone_force=C3d(1.5, 1.5, 1.5),
+                                start_positions=rng.uniform(-area, area, (n_nodes, 3)), disable_lg=True)
+        self.nodes = [DWNode(world=self.swarm[i], scheduler=self.scheduler, transport=LoopbackTransport(self.network),
+                             enable_dash=False) for i in range(n_nodes)]
+        self.scheduler_lag_s = 0.0
+        self.wall_time_s = 0.0
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _track_lag(self, interval_s):
+        # A periodic task that checks how late the loop serves it
+        expected = [self.scheduler.clock() + interval_s]
+
+        def probe():
+            now = self.scheduler.clock()
+            self.scheduler_lag_s = max(self.scheduler_lag_s, now - expected[0])
+            expected[0] = now + interval_s
+        return self.scheduler.add_periodic("lag_probe", interval_s, probe, start_delay_s=interval_s)
+
+    """
+    Runs the scheduler loop in this thread until predicate() is true (checked every poll_s) or timeout_s passed.
+    Returns the seconds it took or None on timeout. Both are in simulated seconds unless the harness runs in real time.
+    """
+    def run_until(self, predicate, timeout_s, poll_s=0.1):
+        start = self.scheduler.clock()
+        wall_start = time.monotonic()
+        result = [None]
+
+        def check():
+            if predicate():
+                result[0] = self.scheduler.clock() - start
+                self.scheduler.stop()
+
+        tasks = [self.scheduler.add_periodic("harness_poll", poll_s, check, start_delay_s=poll_s),
+                 self.scheduler.call_later(timeout_s, self.scheduler.stop, name="harness_timeout")]
+        if not self.scheduler.simulated:
+            tasks.append(self._track_lag(poll_s))
+        try:
+            self.scheduler.run_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.wall_time_s += time.monotonic() - wall_start
+        return result[0]
+
+    def run_for(self, duration_s):
+        self.run_until(lambda: False, duration_s)
+
+    def leaders(self):
+        return collections.Counter(node.middleware.leader_subsystem.leader_uid for node in self.nodes)
+
+    def agreed_leader(self):
+        leaders = self.leaders()
+        if len(leaders) != 1:
+            return None
+        uid = next(iter(leaders))
+        return self.node_by_uid(uid)
+
+    def node_by_uid(self, uid):
+        for node in self.nodes:
+            if node.middleware.uid == uid:
+                return node
+        return None
+
+    def everyone_knows_everyone(self):
+        return all(len(node.node_list) == len(self.nodes) for node in self.nodes)
+
+    """
+    Lets the agreed leader dispatch a shape to the swarm. Returns the flight controller destinations from before, pass
+    them to formation_received to count the nodes that got their target.
+    """
+    def dispatch_formation(self, shape):
+        leader = self.agreed_leader()
+        if leader is None:
+            raise ValueError("The swarm has not agreed on a leader")
+        before = [node.flight_controller.destination for node in self.nodes]
+        leader.cb_new_shape_selected(shape)
+        return before
+
+    def formation_received(self, before):
+        return sum(node.flight_controller.destination is not old for node, old in zip(self.nodes, before))
+
+    def report(self):
+        receivers = [node.middleware.mc_rec for node in self.nodes]
+        lost_fragmented = sum(r.reassembler.messages_lost for r in receivers)
+        timing = f"Sim time: {self.scheduler.clock():.1f}s | Wall time: {self.wall_time_s:.1f}s" \
+            if self.scheduler.simulated else f"Scheduler lag: {self.scheduler_lag_s * 1000:.1f}ms"
+        return f"Nodes: {len(self.nodes)} | Leaders: {len(self.leaders())} | Network: {self.network} | " \
+               f"Fragmented messages lost: {lost_fragmented} | Scheduler tasks: {len(self.scheduler.tasks)} | {timing}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs a simulated swarm of nodes in one process")
+    parser.add_argument('--nodes', type=int, default=100)
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--delay', type=float, default=0.0005, help="Network delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Additional random delay in seconds")
+    parser.add_argument('--reorder', type=float, default=0.0, help="Probability that a datagram is held back")
+    parser.add_argument('--shape', default=None, help="Shape the leader dispatches once elected")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--realtime', action='store_true', help="Run on the wall clock instead of simulated time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    harness = SwarmHarness(args.nodes, loss=args.loss, delay_s=args.delay, jitter_s=args.jitter, reorder=args.reorder,
+                           seed=args.seed, simulated_time=not args.realtime)
+    print(f"Created {len(harness)} nodes in {time.perf_counter() - start:.1f}s")
+
+    elapsed = harness.run_until(lambda: harness.everyone_knows_everyone() and harness.agreed_leader() is not None,
+                                args.timeout)
+    print(f"Membership and election: {'timeout' if elapsed is None else f'{elapsed:.1f}s'}")
+    print(harness.report())
+
+    if args.shape is not None and harness.agreed_leader() is not None:
+        before = harness.dispatch_formation(args.shape)
+        elapsed = harness.run_until(lambda: harness.formation_received(before) == len(harness), args.timeout)
+        print(f"Formation {args.shape} reached {harness.formation_received(before)}/{len(harness)} nodes: "
+              f"{'timeout' if elapsed is None else f'{elapsed:.2f}s'}")
+        print(harness.report())
@@ -0,0 +1,119 @@
+import numpy as np
+
+from middleware.Logger import lg
+
+# Quantization steps: meters, meters per second, meters per second squared
+POSITION_RESOLUTION = 0.01
+VELOCITY_RESOLUTION = 0.01
+ACCELERATION_RESOLUTION = 0.01
+# Every n-th heartbeat carries a full keyframe, the ones in between only the change since that keyframe
+KEYFRAME_INTERVAL = 10
+# Deltas outside this range (int16) force a keyframe
+MAX_DELTA = 0x7FFF
+
+KEYFRAME = 0
+DELTA = 1
+
+_KEYFRAME_IDS = 0x80
+_AXES = ('x', 'y', 'z')
+
+
+def _vector(value):
+    if isinstance(value, dict):
+        return [value[axis] for axis in _AXES]
+    if hasattr(value, 'to_dict'):
+        return _vector(value.to_dict())
+    return list(value)
+
+
+"""
+Heartbeat telemetry as a flat list of integers:
+
+    [KEYFRAME, keyframe id, px, py, pz, vx, vy, vz, ax, ay, az]   quantized state
+    [DELTA, keyframe id, dpx, dpy, dpz, dvx, dvy, dvz, dax, day, daz]   quantized state minus the keyframe
+
+The deltas are taken against the keyframe and not against the previous heartbeat, so a receiver only needs the keyframe
+to decode any later heartbeat. Heartbeats travel over the reliable multicast, which delivers the keyframe before the
+deltas that refer to it. Small integers take one or two bytes in the binary wire format.
+
+A peer that joins in the middle of a keyframe interval cannot decode the deltas. force_keyframe makes the next heartbeat
+a keyframe, the node calls it whenever it hears from a new peer. It is called from the receive thread while encode runs
+on the scheduler, so it only counts a request and the encoder state is changed by encode alone.
+"""
+class TelemetryEncoder:
+    def __init__(self, position_resolution=POSITION_RESOLUTION, velocity_resolution=VELOCITY_RESOLUTION,
+                 acceleration_resolution=ACCELERATION_RESOLUTION, keyframe_interval=KEYFRAME_INTERVAL):
+        self.resolution = np.repeat([position_resolution, velocity_resolution, acceleration_resolution], 3)
+        self.keyframe_interval = keyframe_interval
+        self.keyframe = None
+        self.keyframe_id = -1
+        self.since_keyframe = 0
+        # Written by force_keyframe and encode respectively, a request is open while they differ
+        self.keyframe_requests = 0
+        self._keyframe_requests_served = 0
+
+        # Accounting
+        self.keyframes_sent = 0
+        self.deltas_sent = 0
+
+    def __str__(self):
+        return f"Telemetry: {self.keyframes_sent} keyframes | {self.deltas_sent} deltas"
+
+    def quantize(self, position, velocity, acceleration):
+        state = np.array(_vector(position) + _vector(velocity) + _vector(acceleration), dtype=float)
+        return np.rint(state / self.resolution).astype(np.int64)
+
+    def force_keyframe(self):
+        self.keyframe_requests += 1
+
+    def encode(self, position, velocity, acceleration):
+        state = self.quantize(position, velocity, acceleration)
+        requests = self.keyframe_requests
+        if requests == self._keyframe_requests_served and self.keyframe is not None and \
+                self.since_keyframe < self.keyframe_interval:
+            delta = state - self.keyframe
+            if np.abs(delta).max() <= MAX_DELTA:
+                self.since_keyframe += 1
+                self.deltas_sent += 1
+                return [DELTA, self.keyframe_id] + delta.tolist()
+
+        self.keyframe = state
+        self._keyframe_requests_served = requests
+        self.keyframe_id = (self.keyframe_id + 1) % _KEYFRAME_IDS
+        self.since_keyframe = 1
+        self.keyframes_sent += 1
+        return [KEYFRAME, self.keyframe_id] + state.tolist()
+
+
+"""
+Decodes the telemetry of one sender. decode returns the pos, vel and acc dicts, or None while no matching keyframe has
+been received (a node that joined in the middle of a keyframe interval waits for the next one).
+"""
+class TelemetryDecoder:
+    def __init__(self, position_resolution=POSITION_RESOLUTION, velocity_resolution=VELOCITY_RESOLUTION,
+                 acceleration_resolution=ACCELERATION_RESOLUTION):
+        self.resolution = np.repeat([position_resolution, velocity_resolution, acceleration_resolution], 3)
+        self.keyframe = None
+        self.keyframe_id = None
+
+        # Accounting
+        self.skipped = 0
+
+    def decode(self, payload):
+        if not isinstance(payload, list) or len(payload) != 11:
+            lg.warning(f"Ignoring malformed telemetry {payload}")
+            self.skipped += 1
+            return None
+        kind, keyframe_id, values = payload[0], payload[1], np.array(payload[2:], dtype=np.int64)
+        if kind == KEYFRAME:
+            self.keyframe, self.keyframe_id = values, keyframe_id
+            state = values
+        elif kind == DELTA and self.keyframe is not None and keyframe_id == self.keyframe_id:
+            state = self.keyframe + values
+        else:
+            self.skipped += 1
+            return None
+
+        state = (state * self.resolution).tolist()
+        return {"pos": dict(zip(_AXES, state[0:3])), "vel": dict(zip(_AXES, state[3:6])),
+                "acc": dict(zip(_AXES, state[6:9]))}
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The middleware modules import each other without the package prefix, like in main.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'middleware'))
+
+from Messaging import Message, DefaultHeaders
+from WireFormat import decode_datagram, encode_message, WireFormatError
+
+
+HEADER = {DefaultHeaders.ORIGIN_IP: '10.0.0.1', DefaultHeaders.DESTINATION_IP: '10.0.0.2',
+          DefaultHeaders.UNICAST_PORT: 5000, DefaultHeaders.UID: 'not-a-uuid'}
+
+
+def test_json_message_round_trip():
+    [message] = decode_datagram(encode_message(Message(HEADER, {'x': 1}, 3), wire_format='json'))
+    assert message.header == HEADER
+    assert message.body == {'x': 1}
+    assert message.seq == 3
+
+
+@pytest.mark.parametrize('data', [
+    b'{"header": 1',                               # truncated
+    b'{"foo": 1}',                                 # unknown fields
+    b'{"header": {}}',                             # missing body
+    b'{"header": 1, "body": null}',                # header is not a dict
+    b'{"header": {}, "body": "\xff"}',             # not UTF-8
+    b'{"header": {}, "body": {"__bytes__": "!"}}',  # bytes value that is not base64
+])
+def test_malformed_json_datagram_is_rejected(data):
+    with pytest.raises(WireFormatError):
+        decode_datagram(data)
@@ -0,0 +1,82 @@
+import numpy as np
+
+TRAJECTORY_FIELDS = ('time', 'position', 'velocity', 'acceleration', 'force')
+
+"""
+Fixed capacity ring buffer of the physical state of one or more drones. All storage is allocated up front, recording a
+sample writes into the next slot and overwrites the oldest sample once the buffer is full.
+"""
+class TrajectoryRecorder:
+    def __init__(self, capacity, n_drones=1):
+        self.capacity = capacity
+        self.n_drones = n_drones
+        self.time = np.zeros(capacity)
+        self.position = np.zeros((capacity, n_drones, 3))
+        self.velocity = np.zeros((capacity, n_drones, 3))
+        self.acceleration = np.zeros((capacity, n_drones, 3))
+        self.force = np.zeros((capacity, n_drones, 3))
+        self.samples_recorded = 0
+        self._next = 0
+
+    def __len__(self):
+        return min(self.samples_recorded, self.capacity)
+
+    def __str__(self):
+        return f"Samples: {len(self)}/{self.capacity} | Recorded: {self.samples_recorded}"
+
+    def _advance(self):
+        slot = self._next
+        self._next = (self._next + 1) % self.capacity
+        self.samples_recorded += 1
+        return slot
+
+    def record_arrays(self, t, position, velocity, acceleration, force):
+        slot = self._advance()
+        self.time[slot] = t
+        self.position[slot] = position
+        self.velocity[slot] = velocity
+        self.acceleration[slot] = acceleration
+        self.force[slot] = force
+
+    def record_c3d(self, t, position, velocity, acceleration, force):
+        # Single drone World, copies the components without building intermediate arrays
+        slot = self._advance()
+        self.time[slot] = t
+        for target, vec in ((self.position, position), (self.velocity, velocity),
+                            (self.acceleration, acceleration), (self.force, force)):
+            row = target[slot, 0]
+            row[0] = vec.x
+            row[1] = vec.y
+            row[2] = vec.z
+
+    def _chronological(self):
+        # Indices of the stored samples from oldest to newest
+        if self.samples_recorded <= self.capacity:
+            return np.arange(self.samples_recorded)
+        return (np.arange(self.capacity) + self._next) % self.capacity
+
+    def snapshot(self):
+        idx = self._chronological()
+        return {field: getattr(self, field)[idx] for field in TRAJECTORY_FIELDS}
+
+    """
+    Writes the samples in chronological order to a memory mapped .npy file with a structured dtype and returns the
+    memory map, so large runs can be analysed without loading them into RAM.
+    """
+    def export(self, path):
+        idx = self._chronological()
+        dtype = np.dtype([('time', 'f8'), ('position', 'f8', (self.n_drones, 3)), ('velocity', 'f8', (self.n_drones, 3)),
+                          ('acceleration', 'f8', (self.n_drones, 3)), ('force', 'f8', (self.n_drones, 3))])
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(len(idx),))
+        # Copy in chunks to keep the temporary fancy-index copies small
+        chunk = 4096
+        for start in range(0, len(idx), chunk):
+            part = idx[start:start + chunk]
+            for field in TRAJECTORY_FIELDS:
+                out[field][start:start + len(part)] = getattr(self, field)[part]
+        out.flush()
+        return out
+
+
+def load_trajectory(path):
+    return np.load(path, mmap_mode='r')